@@ -4,9 +4,9 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event, text
 from sqlalchemy.engine import Engine
 from rq import Queue
-from rq.registry import StartedJobRegistry
 import redis
 from datetime import timedelta
+from .job_events import get_active_job_id, TERMINAL_STATUSES
 
 db = SQLAlchemy()
 
@@ -49,16 +49,16 @@ def create_app():
     redis_url = os.environ.get('REDIS_URL', 'redis://localhost:6379')
     redis_conn = redis.from_url(redis_url)
     app.queue = Queue(connection=redis_conn)
+    # Short background jobs (tag propagation) that must not show up as the active task
+    app.tag_queue = Queue('tags', connection=redis_conn)
 
     # Make timedelta available in templates
     app.jinja_env.globals['timedelta'] = timedelta
 
     @app.context_processor
     def inject_active_job_id():
-        registry = StartedJobRegistry(queue=app.queue)
-        running_job_ids = registry.get_job_ids()
-        active_job_id = running_job_ids[0] if running_job_ids else None
-        return dict(active_job_id=active_job_id)
+        # Cached per process for a few seconds; live progress is pushed over /task_events
+        return dict(active_job_id=get_active_job_id(app.queue), terminal_job_statuses=TERMINAL_STATUSES)
 
     with app.app_context():
         # Register Blueprints
@@ -220,6 +220,156 @@ def run_migrations(app):
         except Exception:
             pass
 
+        # Migration for v0.939: Add content_hash to Movie and Show
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE movie ADD COLUMN content_hash VARCHAR(40)"))
+                conn.commit()
+                print("Migrated database: Added content_hash column to Movie.")
+        except Exception:
+            pass
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE show ADD COLUMN content_hash VARCHAR(40)"))
+                conn.commit()
+                print("Migrated database: Added content_hash column to Show.")
+        except Exception:
+            pass
+
+        # Migration for v0.940: Add TMDB fetch concurrency settings
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE service_settings ADD COLUMN tmdb_concurrency INTEGER DEFAULT 8"))
+                conn.commit()
+                print("Migrated database: Added tmdb_concurrency column.")
+        except Exception:
+            pass
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE service_settings ADD COLUMN tmdb_rate_limit INTEGER DEFAULT 20"))
+                conn.commit()
+                print("Migrated database: Added tmdb_rate_limit column.")
+        except Exception:
+            pass
+
+        # Migration for v0.946: Add Tautulli history cursor
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE service_settings ADD COLUMN history_cursor INTEGER"))
+                conn.commit()
+                print("Migrated database: Added history_cursor column.")
+        except Exception:
+            pass
+
+        # Migration for v0.950: Add parallel scoring settings to AISettings
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN scoring_concurrency INTEGER DEFAULT 4"))
+                conn.commit()
+                print("Migrated database: Added scoring_concurrency column.")
+        except Exception:
+            pass
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN requests_per_minute INTEGER DEFAULT 60"))
+                conn.commit()
+                print("Migrated database: Added requests_per_minute column.")
+        except Exception:
+            pass
+
+        # Migration for v0.951: Add tokens-per-minute budget to AISettings
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN tokens_per_minute INTEGER DEFAULT 0"))
+                conn.commit()
+                print("Migrated database: Added tokens_per_minute column.")
+        except Exception:
+            pass
+
+        # Migration for v0.954: Add scoring prompt token budget to AISettings
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN scoring_token_budget INTEGER DEFAULT 0"))
+                conn.commit()
+                print("Migrated database: Added scoring_token_budget column.")
+        except Exception:
+            pass
+
+        # Migration for v0.955: Add prompt encoding to AISettings
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN prompt_encoding VARCHAR(20) DEFAULT 'compact'"))
+                conn.commit()
+                print("Migrated database: Added prompt_encoding column.")
+        except Exception:
+            pass
+
+        # Migration for v0.957: Add local pre-scorer settings to AISettings
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN prescore_enabled BOOLEAN DEFAULT 0"))
+                conn.commit()
+                print("Migrated database: Added prescore_enabled column.")
+        except Exception:
+            pass
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN prescore_confidence INTEGER DEFAULT 90"))
+                conn.commit()
+                print("Migrated database: Added prescore_confidence column.")
+        except Exception:
+            pass
+
+        # Migration for v0.960: Track learning samples and index the score column
+        for table in ('movie', 'show'):
+            try:
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN last_learned_at DATETIME"))
+                    conn.commit()
+                    print(f"Migrated database: Added last_learned_at column to {table}.")
+            except Exception:
+                pass
+
+            try:
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_score ON {table} (score)"))
+                    conn.commit()
+            except Exception:
+                pass
+
+        # Migration for v0.962: Track the rule set each AI score was computed under
+        for table in ('movie', 'show'):
+            try:
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN ai_rules_hash VARCHAR(40)"))
+                    conn.commit()
+                    print(f"Migrated database: Added ai_rules_hash column to {table}.")
+            except Exception:
+                pass
+
+        try:
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE ai_settings ADD COLUMN auto_rescore_after_sync BOOLEAN DEFAULT 0"))
+                conn.commit()
+                print("Migrated database: Added auto_rescore_after_sync column.")
+        except Exception:
+            pass
+
+        # Migration for v0.975: Scoring batches are sized by the token budget; the item count is an optional cap.
+        # New columns rather than reusing batch_size_*_score, so existing installs start uncapped.
+        for column in ('max_items_movies_score', 'max_items_shows_score'):
+            try:
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE ai_settings ADD COLUMN {column} INTEGER DEFAULT 0"))
+                    conn.commit()
+                    print(f"Migrated database: Added {column} column.")
+            except Exception:
+                pass
+
         # Create AISettings table if it doesn't exist
         try:
             db.create_all()
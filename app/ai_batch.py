@@ -0,0 +1,218 @@
+import abc
+import io
+import json
+import os
+import logging
+from .http_client import get_http_session
+
+logger = logging.getLogger(__name__)
+
+# Gemini REST endpoint; point it (and OPENAI_BASE_URL, which the OpenAI SDK reads itself)
+# at a local stub such as scripts/stub_batch_server.py to exercise bulk scoring offline
+GEMINI_API_BASE_URL = os.environ.get('GEMINI_API_BASE_URL', 'https://generativelanguage.googleapis.com')
+
+# Normalized batch states returned by BatchBackend.poll()
+BATCH_RUNNING = 'running'
+BATCH_COMPLETED = 'completed'
+BATCH_FAILED = 'failed'
+
+class BatchBackend(abc.ABC):
+    """
+    Asynchronous bulk-completion interface. submit() takes (custom_id, prompt) pairs, asking
+    for JSON answers when json_mode is set, and returns the ids of the provider batch jobs it
+    created; a submission over the provider's per-job limits is split across several jobs.
+    poll() returns (state, completed, total) for one job and results() returns
+    {custom_id: response text} for its requests that succeeded.
+    """
+    # Provider limits on a single batch job; None means no limit
+    MAX_REQUESTS = None
+    MAX_PAYLOAD_BYTES = None
+
+    def submit(self, requests, display_name, json_mode=True):
+        chunks = list(self.chunk_requests([self.encode_request(custom_id, prompt, json_mode) for custom_id, prompt in requests]))
+        return [
+            self.submit_chunk(chunk, f"{display_name}-{index + 1}" if len(chunks) > 1 else display_name)
+            for index, chunk in enumerate(chunks)
+        ]
+
+    def chunk_requests(self, encoded_requests):
+        """Groups encoded requests into jobs that stay within MAX_REQUESTS and MAX_PAYLOAD_BYTES."""
+        chunk = []
+        chunk_bytes = 0
+        for request in encoded_requests:
+            request_bytes = len(json.dumps(request).encode('utf-8')) + 1
+            if chunk and (
+                (self.MAX_REQUESTS and len(chunk) >= self.MAX_REQUESTS) or
+                (self.MAX_PAYLOAD_BYTES and chunk_bytes + request_bytes > self.MAX_PAYLOAD_BYTES)
+            ):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(request)
+            chunk_bytes += request_bytes
+        if chunk:
+            yield chunk
+
+    @abc.abstractmethod
+    def encode_request(self, custom_id, prompt, json_mode):
+        """One request in the provider's batch input format."""
+
+    @abc.abstractmethod
+    def submit_chunk(self, encoded_requests, display_name):
+        """Creates one provider batch job from encoded requests and returns its id."""
+
+    @abc.abstractmethod
+    def poll(self, batch_id):
+        """Returns (state, completed, total) for a batch job."""
+
+    @abc.abstractmethod
+    def results(self, batch_id):
+        """Returns {custom_id: response text} for the successful requests of a finished job."""
+
+    @abc.abstractmethod
+    def cancel(self, batch_id):
+        """Asks the provider to stop a running batch job."""
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API: a JSONL file of chat completion requests, processed within 24h."""
+    # Per-file limits of the Batch API
+    MAX_REQUESTS = 50000
+    MAX_PAYLOAD_BYTES = 190 * 1024 * 1024
+    STATES = {
+        'validating': BATCH_RUNNING, 'in_progress': BATCH_RUNNING, 'finalizing': BATCH_RUNNING,
+        'cancelling': BATCH_RUNNING, 'completed': BATCH_COMPLETED,
+        'failed': BATCH_FAILED, 'expired': BATCH_FAILED, 'cancelled': BATCH_FAILED,
+    }
+
+    def __init__(self, api_key, model):
+        from .ai_service import get_openai_client
+        self.client = get_openai_client(api_key, sdk_retries=True)
+        self.model = model
+
+    def encode_request(self, custom_id, prompt, json_mode):
+        return {
+            'custom_id': custom_id,
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': dict({
+                'model': self.model,
+                'messages': [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": prompt}
+                ]
+            }, **({'response_format': {'type': 'json_object'}} if json_mode else {}))
+        }
+
+    def submit_chunk(self, encoded_requests, display_name):
+        payload = io.BytesIO('\n'.join(json.dumps(request) for request in encoded_requests).encode('utf-8'))
+        input_file = self.client.files.create(file=(f"{display_name}.jsonl", payload), purpose='batch')
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+            metadata={'description': display_name}
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        completed = (counts.completed + counts.failed) if counts else 0
+        total = counts.total if counts else 0
+        return self.STATES.get(batch.status, BATCH_RUNNING), completed, total
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            return {}
+        content = self.client.files.content(batch.output_file_id).text
+        texts = {}
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                logger.warning(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response.get('status_code')}")
+                continue
+            texts[record['custom_id']] = response['body']['choices'][0]['message']['content']
+        return texts
+
+    def cancel(self, batch_id):
+        self.client.batches.cancel(batch_id)
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch Mode (batchGenerateContent) with inline requests, over the REST API."""
+    # Inline requests are capped at 20MB per call; the margin covers the request envelope
+    MAX_PAYLOAD_BYTES = 18 * 1024 * 1024
+    STATES = {
+        'BATCH_STATE_PENDING': BATCH_RUNNING, 'BATCH_STATE_RUNNING': BATCH_RUNNING,
+        'BATCH_STATE_SUCCEEDED': BATCH_COMPLETED,
+        'BATCH_STATE_FAILED': BATCH_FAILED, 'BATCH_STATE_CANCELLED': BATCH_FAILED, 'BATCH_STATE_EXPIRED': BATCH_FAILED,
+    }
+
+    def __init__(self, api_key, model, base_url=None):
+        self.session = get_http_session()
+        self.headers = {'x-goog-api-key': api_key, 'Content-Type': 'application/json'}
+        self.model = model
+        self.base_url = (base_url or GEMINI_API_BASE_URL).rstrip('/')
+
+    def _get(self, batch_id):
+        response = self.session.get(f"{self.base_url}/v1beta/{batch_id}", headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    def encode_request(self, custom_id, prompt, json_mode):
+        return {
+            'request': dict(
+                {'contents': [{'parts': [{'text': prompt}]}]},
+                **({'generation_config': {'response_mime_type': 'application/json'}} if json_mode else {})
+            ),
+            'metadata': {'key': custom_id}
+        }
+
+    def submit_chunk(self, encoded_requests, display_name):
+        body = {
+            'batch': {
+                'display_name': display_name,
+                'input_config': {'requests': {'requests': encoded_requests}}
+            }
+        }
+        response = self.session.post(f"{self.base_url}/v1beta/models/{self.model}:batchGenerateContent", headers=self.headers, json=body)
+        response.raise_for_status()
+        return response.json()['name']
+
+    def poll(self, batch_id):
+        operation = self._get(batch_id)
+        metadata = operation.get('metadata', {})
+        stats = metadata.get('batchStats', {})
+        total = int(stats.get('requestCount', 0))
+        completed = int(stats.get('successfulRequestCount', 0)) + int(stats.get('failedRequestCount', 0))
+        state = self.STATES.get(metadata.get('state'), BATCH_RUNNING)
+        if operation.get('done') and state == BATCH_RUNNING:
+            state = BATCH_FAILED if operation.get('error') else BATCH_COMPLETED
+        return state, completed, total
+
+    def results(self, batch_id):
+        operation = self._get(batch_id)
+        output = operation.get('response') or operation.get('metadata', {}).get('output') or {}
+        texts = {}
+        for entry in output.get('inlinedResponses', {}).get('inlinedResponses', []):
+            key = entry.get('metadata', {}).get('key')
+            if 'error' in entry or not key:
+                logger.warning(f"Batch request {key} failed: {entry.get('error')}")
+                continue
+            parts = entry['response']['candidates'][0]['content']['parts']
+            texts[key] = ''.join(part.get('text', '') for part in parts)
+        return texts
+
+    def cancel(self, batch_id):
+        response = self.session.post(f"{self.base_url}/v1beta/{batch_id}:cancel", headers=self.headers)
+        response.raise_for_status()
+
+def get_batch_backend(provider, api_key, model):
+    if provider == 'OpenAI':
+        return OpenAIBatchBackend(api_key, model)
+    if provider == 'Gemini':
+        return GeminiBatchBackend(api_key, model)
+    raise ValueError(f"Unsupported provider: {provider}")
@@ -0,0 +1,235 @@
+import re
+import threading
+import time
+from collections import deque
+
+# Rough prompt size estimate used to charge the tokens-per-minute budget before a call;
+# the provider's reported usage corrects it afterwards
+CHARS_PER_TOKEN = 4
+# Pause applied after a 429 that carries no retry hint (doubled per consecutive attempt by the caller)
+DEFAULT_THROTTLE_PAUSE = 2
+WINDOW_SECONDS = 60
+# Redis key holding the limiter snapshot of the last scoring job
+LIMITER_STATS_KEY = 'ai-limiter-stats'
+
+class AdaptiveRateLimiter:
+    """
+    Shared gate for LLM calls with a requests-per-minute budget, a tokens-per-minute
+    budget and an adaptive concurrency limit.
+
+    acquire() blocks until both sliding-window budgets allow the call, no provider pause
+    is in effect and a concurrency slot is free. release() feeds back what the provider
+    reported: a throttle halves the concurrency limit and pauses every caller until the
+    retry-after time, exhausted quotas pause until their reset, and each run of successful
+    calls raises the limit by one again, up to max_concurrency (AIMD).
+    """
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, max_concurrency=1):
+        self.lock = threading.Condition()
+        self.requests = deque()    # start times of calls in the last minute
+        self.token_log = deque()   # (time, tokens) charged in the last minute
+        self.token_total = 0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.successes = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttles = 0
+        self.total_requests = 0
+        self.concurrency = None
+        self.configure(requests_per_minute, tokens_per_minute, max_concurrency)
+
+    def configure(self, requests_per_minute, tokens_per_minute, max_concurrency):
+        with self.lock:
+            self.requests_per_minute = requests_per_minute or 0
+            self.tokens_per_minute = tokens_per_minute or 0
+            self.max_concurrency = max(1, max_concurrency or 1)
+            if self.concurrency is None or self.concurrency > self.max_concurrency:
+                self.concurrency = self.max_concurrency
+            self.lock.notify_all()
+
+    def _prune(self, now):
+        while self.requests and now - self.requests[0] >= WINDOW_SECONDS:
+            self.requests.popleft()
+        while self.token_log and now - self.token_log[0][0] >= WINDOW_SECONDS:
+            self.token_total -= self.token_log.popleft()[1]
+
+    def _delay(self, now, tokens):
+        """Seconds until a call charging `tokens` fits every budget."""
+        delay = self.paused_until - now
+        if self.requests_per_minute and len(self.requests) >= self.requests_per_minute:
+            oldest = self.requests[len(self.requests) - self.requests_per_minute]
+            delay = max(delay, oldest + WINDOW_SECONDS - now)
+        if self.tokens_per_minute and self.token_log and self.token_total + tokens > self.tokens_per_minute:
+            # Wait for enough of the window to expire; a single oversized call still goes out alone
+            excess = self.token_total + tokens - self.tokens_per_minute
+            for logged_at, logged_tokens in self.token_log:
+                excess -= logged_tokens
+                if excess <= 0:
+                    delay = max(delay, logged_at + WINDOW_SECONDS - now)
+                    break
+            else:
+                delay = max(delay, self.token_log[-1][0] + WINDOW_SECONDS - now)
+        return max(delay, 0.0)
+
+    def acquire(self, tokens=0):
+        started = time.monotonic()
+        waited = False
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                delay = self._delay(now, tokens)
+                if delay <= 0 and self.in_flight < self.concurrency:
+                    break
+                waited = True
+                self.lock.wait(timeout=delay if delay > 0 else None)
+            self.in_flight += 1
+            self.total_requests += 1
+            self.requests.append(now)
+            if tokens:
+                self.token_log.append((now, tokens))
+                self.token_total += tokens
+            if waited:
+                self.waits += 1
+                self.wait_seconds += now - started
+
+    def release(self, throttled=False, retry_after=None, remaining_requests=None, remaining_tokens=None,
+                reset_after=None, tokens_used=None, tokens_estimated=0):
+        with self.lock:
+            now = time.monotonic()
+            self.in_flight = max(0, self.in_flight - 1)
+            if tokens_used is not None and tokens_used != tokens_estimated:
+                self.token_log.append((now, tokens_used - tokens_estimated))
+                self.token_total += tokens_used - tokens_estimated
+
+            if throttled:
+                self.throttles += 1
+                self.successes = 0
+                self.concurrency = max(1, self.concurrency // 2)
+                pause = retry_after if retry_after is not None else DEFAULT_THROTTLE_PAUSE
+                self.paused_until = max(self.paused_until, now + pause)
+            else:
+                self.successes += 1
+                if self.successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self.successes = 0
+
+            # The provider says the quota is used up; hold everyone until it resets
+            if (remaining_requests == 0 or remaining_tokens == 0) and reset_after:
+                self.paused_until = max(self.paused_until, now + reset_after)
+            self.lock.notify_all()
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            self._prune(now)
+            return {
+                'requests_per_minute': self.requests_per_minute,
+                'tokens_per_minute': self.tokens_per_minute,
+                'current_rpm': len(self.requests),
+                'current_tpm': self.token_total,
+                'concurrency': self.concurrency,
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'total_requests': self.total_requests,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 1),
+                'throttles': self.throttles,
+                'paused_for': round(max(0.0, self.paused_until - now), 1)
+            }
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider, api_key, requests_per_minute=0, tokens_per_minute=0, max_concurrency=1):
+    """
+    Returns the process-wide limiter for a provider account, so every concurrent batch
+    (and the learning call) draws from the same budget. Settings changes are applied in place.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get((provider, api_key))
+        if limiter is None:
+            limiter = _limiters[(provider, api_key)] = AdaptiveRateLimiter(requests_per_minute, tokens_per_minute, max_concurrency)
+            return limiter
+    limiter.configure(requests_per_minute, tokens_per_minute, max_concurrency)
+    return limiter
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def parse_duration(value):
+    """Parses provider durations such as '20ms', '1.5s', '6m0s' or a plain number of seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    parts = re.findall(r'([\d.]+)(ms|s|m|h)', value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+def rate_limit_signals(headers):
+    """
+    Extracts retry-after and remaining-quota hints from response headers (OpenAI's
+    x-ratelimit-* set). Missing headers come back as None.
+    """
+    if not headers:
+        return {}
+    retry_after = None
+    if headers.get('retry-after-ms'):
+        retry_after = parse_duration(headers.get('retry-after-ms'))
+        retry_after = retry_after / 1000 if retry_after is not None else None
+    if retry_after is None:
+        retry_after = parse_duration(headers.get('retry-after'))
+
+    remaining_requests = _header_int(headers, 'x-ratelimit-remaining-requests')
+    remaining_tokens = _header_int(headers, 'x-ratelimit-remaining-tokens')
+    resets = [
+        parse_duration(headers.get(name))
+        for name, remaining in (('x-ratelimit-reset-requests', remaining_requests), ('x-ratelimit-reset-tokens', remaining_tokens))
+        if remaining == 0
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return {
+        'retry_after': retry_after,
+        'remaining_requests': remaining_requests,
+        'remaining_tokens': remaining_tokens,
+        'reset_after': max(resets) if resets else None
+    }
+
+def is_rate_limit_error(error):
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if status == 429:
+        return True
+    error_str = str(error)
+    return "429" in error_str or "Resource has been exhausted" in error_str
+
+# Status codes and exception types of provider failures that are worth retrying as is
+TRANSIENT_STATUS_CODES = (408, 500, 502, 503, 504)
+TRANSIENT_ERROR_TYPES = (
+    'APIConnectionError', 'APITimeoutError', 'InternalServerError', 'ServiceUnavailable',
+    'DeadlineExceeded', 'ConnectionError', 'Timeout', 'ConnectTimeout', 'ReadTimeout'
+)
+
+def is_transient_error(error):
+    """Timeouts, dropped connections and 5xx answers; rate limits are handled separately."""
+    status = getattr(error, 'status_code', None) or getattr(error, 'code', None)
+    if status in TRANSIENT_STATUS_CODES:
+        return True
+    return type(error).__name__ in TRANSIENT_ERROR_TYPES
+
+def retry_delay_from_error(error):
+    """Reads the retry delay Gemini embeds in its ResourceExhausted message, if any."""
+    error_str = str(error)
+    match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', error_str) or re.search(r'retry in ([\d.]+)\s*s', error_str, re.IGNORECASE)
+    return float(match.group(1)) if match else None
@@ -1,27 +1,133 @@
 import google.generativeai as genai
 from openai import OpenAI
 import json
+import re
 import time
 import logging
+import threading
+from .ai_limiter import get_rate_limiter, estimate_tokens, rate_limit_signals, is_rate_limit_error, is_transient_error, retry_delay_from_error
+from .ai_batch import get_batch_backend
 
 logger = logging.getLogger(__name__)
 
+# Prompt token budgets used when AISettings.scoring_token_budget is 0, by model name prefix.
+# They sit well under each context window so answers stay fast and complete.
+MODEL_TOKEN_BUDGETS = {
+    'gemini-1.5': 32000,
+    'gemini-2': 32000,
+    'gpt-4o': 16000,
+    'gpt-4': 8000,
+    'gpt-3.5': 8000,
+}
+DEFAULT_TOKEN_BUDGET = 8000
+# Answer tokens reserved per item ('"12345": 85,')
+SCORING_OUTPUT_TOKENS_PER_ITEM = 10
+# Overviews are cut to this many characters, at a word boundary, before scoring
+MAX_OVERVIEW_CHARS = 1000
+
+# How item lists are embedded in prompts. 'json' is the original indented layout;
+# 'compact' is minified JSON; 'table' is one tab-separated header line plus one row per item.
+PROMPT_ENCODINGS = ('json', 'compact', 'table')
+DEFAULT_PROMPT_ENCODING = 'compact'
+
+# Follow-up calls made for ids a scoring answer left out; each one uses at most half the previous batch size
+SCORING_RECOVERY_ATTEMPTS = 2
+# "id": score pairs in an answer that is not valid JSON as a whole (truncated, trailing text, stray commas...)
+# A pair only counts when a delimiter follows, so a number cut off at the end of a truncated answer is re-asked
+SCORE_PAIR_RE = re.compile(r'["\']?([\w-]+)["\']?\s*:\s*["\']?(-?\d+(?:\.\d+)?)["\']?(?=\s*[,}\]\n])')
+# Complete {"id": ..., "score": ...} objects (in either key order) in a list-shaped answer that is not valid JSON
+SCORE_OBJECT_RE = re.compile(
+    r'\{\s*["\']?id["\']?\s*:\s*["\']?([\w-]+)["\']?\s*,\s*["\']?score["\']?\s*:\s*["\']?(-?\d+(?:\.\d+)?)["\']?\s*\}'
+    r'|\{\s*["\']?score["\']?\s*:\s*["\']?(-?\d+(?:\.\d+)?)["\']?\s*,\s*["\']?id["\']?\s*:\s*["\']?([\w-]+)["\']?\s*\}'
+)
+
+def _table_cell(value):
+    if value is None:
+        return ''
+    return ' '.join(str(value).split())
+
+def encode_items(items, encoding=DEFAULT_PROMPT_ENCODING):
+    if encoding == 'compact':
+        return json.dumps(items, separators=(',', ':'), ensure_ascii=False)
+    if encoding == 'table':
+        columns = list(dict.fromkeys(column for item in items for column in item))
+        lines = ['\t'.join(columns)]
+        lines.extend('\t'.join(_table_cell(item.get(column)) for column in columns) for item in items)
+        return '\n'.join(lines)
+    return json.dumps(items, indent=2)
+
+def describe_encoding(encoding):
+    """One-line note placed before encoded items so the model knows how to read them."""
+    if encoding == 'table':
+        return "(Tab-separated: the first line names the columns, each following line is one item.)"
+    return "(JSON array, one object per item.)"
+
+def default_token_budget(model_name):
+    for prefix, budget in MODEL_TOKEN_BUDGETS.items():
+        if (model_name or '').startswith(prefix):
+            return budget
+    return DEFAULT_TOKEN_BUDGET
+
+def truncate_overview(overview, max_chars=MAX_OVERVIEW_CHARS):
+    """Deterministically shortens an overview so the same text always yields the same prompt."""
+    if not overview or len(overview) <= max_chars:
+        return overview
+    return overview[:max_chars].rsplit(' ', 1)[0].rstrip(' ,.;:') + '...'
+
+# Provider clients keyed by (provider, api_key[, model]), reused by every AIService in this
+# process so connection pools and setup survive across batches, retries and jobs
+_clients = {}
+_clients_lock = threading.Lock()
+_gemini_configured_key = None
+
+def get_openai_client(api_key, sdk_retries=False):
+    """
+    Live calls get a client without SDK retries: _call_model retries them itself so every
+    429 is seen and paced by the limiter. sdk_retries=True keeps the SDK's own retries, for
+    the batch API calls that bypass the limiter.
+    """
+    with _clients_lock:
+        client = _clients.get(('OpenAI', api_key, sdk_retries))
+        if client is None:
+            client = _clients[('OpenAI', api_key, sdk_retries)] = OpenAI(api_key=api_key) if sdk_retries else OpenAI(api_key=api_key, max_retries=0)
+        return client
+
+def get_gemini_model(api_key, model_name):
+    global _gemini_configured_key
+    with _clients_lock:
+        model = _clients.get(('Gemini', api_key, model_name))
+        if model is None:
+            # genai.configure is process-global, so only call it when the key actually changes
+            if _gemini_configured_key != api_key:
+                genai.configure(api_key=api_key)
+                _gemini_configured_key = api_key
+            model = _clients[('Gemini', api_key, model_name)] = genai.GenerativeModel(model_name)
+        return model
+
 class AIService:
     def __init__(self, settings):
         self.provider = settings.provider
         self.api_key = settings.api_key
         self.learning_model = settings.learning_model
         self.scoring_model = settings.scoring_model
+        self.prompt_encoding = settings.prompt_encoding if settings.prompt_encoding in PROMPT_ENCODINGS else DEFAULT_PROMPT_ENCODING
+        # One limiter per provider account, shared by every batch and job in this process
+        self.limiter = get_rate_limiter(
+            self.provider, self.api_key,
+            settings.requests_per_minute, settings.tokens_per_minute, settings.scoring_concurrency
+        )
 
     def generate_rules(self, kept_items, deleted_items, current_rules=""):
         prompt = f"""
         You are an expert media curator. Analyze the user's library to understand their taste.
         
+        Items below are listed as follows: {describe_encoding(self.prompt_encoding)}
+        
         Here are items the user explicitly KEPT (or watched via Tautulli):
-        {json.dumps(kept_items, indent=2)}
+        {encode_items(kept_items, self.prompt_encoding)}
         
         Here are items the user explicitly DELETED:
-        {json.dumps(deleted_items, indent=2)}
+        {encode_items(deleted_items, self.prompt_encoding)}
         
         Current Rules (if any):
         {current_rules}
@@ -66,15 +172,43 @@ class AIService:
         cleaned_text = response_text.replace('```json', '').replace('```', '').strip()
         return cleaned_text
 
-    def score_items(self, items, rules):
+    def consolidate_rules(self, proposal_sets, current_rules=""):
+        """Merges rule proposals learned from separate slices of the library into one proposal set."""
         prompt = f"""
+        You are an expert media curator. Several analysts each studied a different slice of the user's
+        kept and deleted items and proposed changes to the scoring rules. Merge their proposals into one set.
+        
+        Current Rules (if any):
+        {current_rules}
+        
+        Proposals from each slice (a JSON array with one object per slice):
+        {json.dumps(proposal_sets, separators=(',', ':'), ensure_ascii=False)}
+        
+        - Merge proposals that describe the same pattern into a single rule, keeping the most specific wording.
+        - Prefer patterns supported by several slices; drop proposals contradicted by most slices.
+        - Keep the scoring style ("Score higher for...", "Score lower for...", "Boost score if...").
+        - A refinement's "original_rule" must be one of the Current Rules.
+        - Say in each "reason" how many slices support the pattern.
+        
+        Output a JSON object with two keys: "refinements" and "new_rules", in the same format as the proposals.
+        "refinements" format: {{ "original_rule": "...", "new_rule": "...", "reason": "..." }}
+        "new_rules" format: {{ "rule": "...", "reason": "..." }}
+        
+        Do not include markdown formatting like ```json. Just the raw JSON string.
+        """
+        
+        response_text = self._call_model(prompt, model_type='learning', json_mode=True)
+        return response_text.replace('```json', '').replace('```', '').strip()
+
+    def scoring_prompt(self, items, rules):
+        return f"""
         You are an expert media curator. Score the following items based on these rules:
         
         SCORING RULES:
         {rules}
         
-        ITEMS TO SCORE:
-        {json.dumps(items, indent=2)}
+        ITEMS TO SCORE {describe_encoding(self.prompt_encoding)}:
+        {encode_items(items, self.prompt_encoding)}
         
         For each item, assign a score from 0 to 100 based on how well it fits the rules.
         - 0-20: Strong candidate for deletion (matches "Score lower" or "Delete" rules).
@@ -85,53 +219,170 @@ class AIService:
         Example format: {{ "123": 85, "456": 10 }}
         Do not include markdown formatting like ```json. Just the raw JSON string.
         """
+
+    def plan_scoring_batches(self, items, rules, token_budget=None, max_items=None):
+        """
+        Packs items into scoring prompts by estimated token count. Each batch is filled until
+        the prompt (template, rules, items and the expected answer) would exceed token_budget,
+        or max_items is reached. An item too large for any batch is sent on its own.
+        """
+        token_budget = token_budget or default_token_budget(self.scoring_model)
+        available = token_budget - estimate_tokens(self.scoring_prompt([], rules))
+        batch = []
+        used = 0
+        for item in items:
+            cost = estimate_tokens(encode_items([item], self.prompt_encoding)) + SCORING_OUTPUT_TOKENS_PER_ITEM
+            if batch and (used + cost > available or (max_items and len(batch) >= max_items)):
+                yield batch
+                batch = []
+                used = 0
+            batch.append(item)
+            used += cost
+        if batch:
+            yield batch
+
+    def score_items(self, items, rules, recovery_attempts=SCORING_RECOVERY_ATTEMPTS):
+        prompt = self.scoring_prompt(items, rules)
         
-        response_text = self._call_model(prompt, model_type='scoring')
+        response_text = self._call_model(prompt, model_type='scoring', json_mode=True)
+        scores = self.parse_scores(response_text, [item['id'] for item in items])
+
+        # Only the ids the answer left out are asked again, in smaller batches. A failed
+        # follow-up call is logged and skipped so the scores already parsed are still returned.
+        missing = [item for item in items if str(item['id']) not in scores]
+        if missing and recovery_attempts > 0:
+            size = max(1, len(items) // 2)
+            logger.warning(f"AI response covered {len(items) - len(missing)}/{len(items)} items; re-scoring {len(missing)} in batches of {size}")
+            for start in range(0, len(missing), size):
+                try:
+                    scores.update(self.score_items(missing[start:start + size], rules, recovery_attempts - 1))
+                except Exception as e:
+                    logger.error(f"Re-scoring {len(missing[start:start + size])} missing items failed: {str(e)}")
+        return scores
+
+    def parse_scores(self, response_text, item_ids=()):
+        """
+        Returns {item id (str): score} from a scoring answer. Valid JSON is used as is, after
+        unwrapping a single top-level key such as {"scores": {...}} or {"results": [...]} unless
+        that key is one of the requested item_ids;
+        otherwise every complete {"id", "score"} object, or failing that every well-formed
+        "id": score pair, is salvaged from the text.
+        """
+        # Clean up potential markdown formatting
+        cleaned_text = (response_text or '').replace('```json', '').replace('```', '').strip()
         try:
-            # Clean up potential markdown formatting
-            cleaned_text = response_text.replace('```json', '').replace('```', '').strip()
-            return json.loads(cleaned_text)
+            parsed = json.loads(cleaned_text)
         except json.JSONDecodeError:
+            parsed = None
+
+        # JSON mode often wraps the answer in one key of its own choosing
+        if isinstance(parsed, dict) and len(parsed) == 1:
+            key, value = next(iter(parsed.items()))
+            if isinstance(value, (dict, list)) and key not in {str(item_id) for item_id in item_ids}:
+                parsed = value
+
+        if isinstance(parsed, dict):
+            return {str(item_id): score for item_id, score in parsed.items()}
+        if isinstance(parsed, list):
+            # Some models answer [{"id": 1, "score": 80}, ...] despite the requested format
+            return {str(entry['id']): entry['score'] for entry in parsed if isinstance(entry, dict) and 'id' in entry and 'score' in entry}
+
+        salvaged = {
+            id_first or id_last: int(float(score_last or score_first))
+            for id_first, score_last, score_first, id_last in SCORE_OBJECT_RE.findall(cleaned_text)
+        }
+        if not salvaged:
+            salvaged = {item_id: int(float(score)) for item_id, score in SCORE_PAIR_RE.findall(cleaned_text)}
+        if salvaged:
+            logger.warning(f"AI response was not valid JSON; salvaged {len(salvaged)} scores")
+        else:
             logger.error(f"Failed to decode JSON from AI response: {response_text}")
-            return {}
+        return salvaged
+
+    def batch_backend(self):
+        return get_batch_backend(self.provider, self.api_key, self.scoring_model)
+
+    def submit_bulk_scoring(self, batches, rules, display_name):
+        """
+        Sends every (custom_id, items) batch to the provider's batch API instead of live calls,
+        as one job or several when the provider's per-job limits require it. Batch jobs have
+        their own quota, so the limiter is not involved. Returns the provider batch ids.
+        """
+        requests = [(custom_id, self.scoring_prompt(items, rules)) for custom_id, items in batches]
+        return self.batch_backend().submit(requests, display_name)
 
-    def _call_model(self, prompt, model_type='learning'):
+    def bulk_scoring_results(self, batch_id, item_ids=None):
+        """
+        Returns {custom_id: scores} for the requests of a finished batch job that succeeded.
+        item_ids maps each custom_id to the item ids it asked about.
+        """
+        texts = self.batch_backend().results(batch_id)
+        return {custom_id: self.parse_scores(text, (item_ids or {}).get(custom_id, ())) for custom_id, text in texts.items()}
+
+    def _call_model(self, prompt, model_type='learning', json_mode=False):
         model_name = self.learning_model if model_type == 'learning' else self.scoring_model
         
         max_retries = 5
         base_delay = 2
+        estimated_tokens = estimate_tokens(prompt)
         
         for attempt in range(max_retries):
+            # Waits for the shared RPM/TPM budgets and a concurrency slot
+            self.limiter.acquire(estimated_tokens)
             try:
-                if self.provider == 'Gemini':
-                    genai.configure(api_key=self.api_key)
-                    model = genai.GenerativeModel(model_name)
-                    response = model.generate_content(prompt)
-                    return response.text
-                    
-                elif self.provider == 'OpenAI':
-                    client = OpenAI(api_key=self.api_key)
-                    response = client.chat.completions.create(
-                        model=model_name,
-                        messages=[
-                            {"role": "system", "content": "You are a helpful assistant."},
-                            {"role": "user", "content": prompt}
-                        ]
-                    )
-                    return response.choices[0].message.content
-                
-                else:
-                    raise ValueError(f"Unsupported provider: {self.provider}")
-            
+                text, usage = self._request(prompt, model_name, json_mode)
             except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "Resource has been exhausted" in error_str:
-                    if attempt < max_retries - 1:
-                        sleep_time = base_delay * (2 ** attempt)
-                        logger.warning(f"Rate limit hit (429). Retrying in {sleep_time} seconds... (Attempt {attempt + 1}/{max_retries})")
-                        time.sleep(sleep_time)
+                if not is_rate_limit_error(e):
+                    self.limiter.release(tokens_estimated=estimated_tokens)
+                    # Timeouts, dropped connections and 5xx answers are retried without throttling everyone else
+                    if is_transient_error(e) and attempt < max_retries - 1:
+                        delay = base_delay * (2 ** attempt)
+                        logger.warning(f"Transient AI service error: {str(e)}. Retrying in {delay} seconds... (Attempt {attempt + 1}/{max_retries})")
+                        time.sleep(delay)
                         continue
-                    else:
-                        logger.error("Max retries reached for AI service.")
-                        raise Exception("AI Service Rate Limit Exceeded. Please check your API quota or try again later.") from e
-                raise e
+                    raise e
+                
+                signals = rate_limit_signals(getattr(getattr(e, 'response', None), 'headers', None))
+                if signals.get('retry_after') is None:
+                    signals['retry_after'] = retry_delay_from_error(e) or base_delay * (2 ** attempt)
+                # Throttles pause every caller sharing the limiter, not just this thread
+                self.limiter.release(throttled=True, **signals)
+                if attempt < max_retries - 1:
+                    logger.warning(f"Rate limit hit (429). Retrying in {signals['retry_after']} seconds... (Attempt {attempt + 1}/{max_retries})")
+                    continue
+                logger.error("Max retries reached for AI service.")
+                raise Exception("AI Service Rate Limit Exceeded. Please check your API quota or try again later.") from e
+            
+            self.limiter.release(tokens_estimated=estimated_tokens, **usage)
+            return text
+
+    def _request(self, prompt, model_name, json_mode=False):
+        """
+        Performs one provider call. Returns (text, usage) where usage holds limiter feedback.
+        json_mode asks the provider for a syntactically valid JSON answer (structured output).
+        """
+        if self.provider == 'Gemini':
+            model = get_gemini_model(self.api_key, model_name)
+            generation_config = {'response_mime_type': 'application/json'} if json_mode else None
+            response = model.generate_content(prompt, generation_config=generation_config)
+            metadata = getattr(response, 'usage_metadata', None)
+            return response.text, {'tokens_used': getattr(metadata, 'total_token_count', None)}
+            
+        elif self.provider == 'OpenAI':
+            client = get_openai_client(self.api_key)
+            options = {'response_format': {'type': 'json_object'}} if json_mode else {}
+            raw = client.chat.completions.with_raw_response.create(
+                model=model_name,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": prompt}
+                ],
+                **options
+            )
+            response = raw.parse()
+            usage = rate_limit_signals(raw.headers)
+            usage['tokens_used'] = response.usage.total_tokens if response.usage else None
+            return response.choices[0].message.content, usage
+        
+        else:
+            raise ValueError(f"Unsupported provider: {self.provider}")
@@ -2,9 +2,12 @@ import json
 from flask import Blueprint, render_template, request, jsonify, current_app
 from .. import db
 from ..models import ServiceSettings, AISettings
-from ..tasks.ai import learn_user_preferences, score_media_items
+from ..tasks.ai import learn_user_preferences, score_media_items, count_stale_items, get_active_bulk_run
+from ..job_events import get_active_job_id
+from ..ai_limiter import LIMITER_STATS_KEY
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
 from rq import Queue
-from rq.registry import StartedJobRegistry
 from redis import Redis
 import os
 
@@ -16,9 +19,7 @@ def ai_dashboard():
     sonarr_settings = ServiceSettings.query.filter_by(service_name='Sonarr').first()
     
     # Check for active jobs
-    registry = StartedJobRegistry(queue=current_app.queue)
-    active_job_ids = registry.get_job_ids()
-    active_job_id = active_job_ids[0] if active_job_ids else None
+    active_job_id = get_active_job_id(current_app.queue)
     
     # Parse proposals if they exist
     radarr_proposals = None
@@ -35,11 +36,19 @@ def ai_dashboard():
         except json.JSONDecodeError:
             pass
 
+    # Items an incremental run would score: new since the last run or scored under older rules
+    radarr_stale = count_stale_items('Radarr', radarr_settings.ai_rules) if radarr_settings and radarr_settings.ai_rules else 0
+    sonarr_stale = count_stale_items('Sonarr', sonarr_settings.ai_rules) if sonarr_settings and sonarr_settings.ai_rules else 0
+
     return render_template('ai_dashboard.html', 
                            radarr_rules=radarr_settings.ai_rules if radarr_settings else "",
                            sonarr_rules=sonarr_settings.ai_rules if sonarr_settings else "",
                            radarr_proposals=radarr_proposals,
                            sonarr_proposals=sonarr_proposals,
+                           radarr_stale=radarr_stale,
+                           sonarr_stale=sonarr_stale,
+                           radarr_bulk_run=get_active_bulk_run('Radarr'),
+                           sonarr_bulk_run=get_active_bulk_run('Sonarr'),
                            active_job_id=active_job_id)
 
 @bp.route('/ai/save_rules', methods=['POST'])
@@ -52,7 +61,7 @@ def save_rules():
     if settings:
         settings.ai_rules = rules
         db.session.commit()
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'stale': count_stale_items(service_name, rules)})
     return jsonify({'status': 'error', 'message': 'Service not found'})
 
 @bp.route('/ai/proposal/apply', methods=['POST'])
@@ -108,22 +117,27 @@ def apply_proposal():
             settings.ai_rule_proposals = json.dumps(proposals)
             
         db.session.commit()
-        return jsonify({'status': 'success', 'rules': settings.ai_rules})
+        stale = count_stale_items(service_name, settings.ai_rules) if settings.ai_rules else 0
+        return jsonify({'status': 'success', 'rules': settings.ai_rules, 'stale': stale})
         
     except (ValueError, IndexError, KeyError) as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
 @bp.route('/ai/learn/<service>', methods=['POST'])
 def start_learning(service):
-    # Increase timeout to 10 minutes (600s) for learning tasks
-    job = current_app.queue.enqueue(learn_user_preferences, service, job_timeout=600)
+    full_history = request.args.get('full', 'false').lower() == 'true'
+    # Increase timeout to 10 minutes (600s) for learning tasks; full-history runs make many calls
+    job = current_app.queue.enqueue(learn_user_preferences, service, full_history=full_history, job_timeout=3600 if full_history else 600)
     return jsonify({'status': 'started', 'job_id': job.get_id()})
 
 @bp.route('/ai/score/<service>', methods=['POST'])
 def start_scoring(service):
     resume = request.args.get('resume', 'false').lower() == 'true'
-    # Increase timeout to 20 minutes (1200s) for scoring tasks to handle large batches and retries
-    job = current_app.queue.enqueue(score_media_items, service, resume_mode=resume, job_timeout=1200)
+    bulk = request.args.get('bulk', 'false').lower() == 'true'
+    incremental = request.args.get('incremental', 'false').lower() == 'true'
+    # Increase timeout to 20 minutes (1200s) for scoring tasks to handle large batches and retries.
+    # Bulk runs only submit here; scheduled poll jobs wait for the provider batch jobs.
+    job = current_app.queue.enqueue(score_media_items, service, resume_mode=resume, bulk=bulk, incremental=incremental, job_timeout=1200)
     return jsonify({'status': 'started', 'job_id': job.get_id()})
 
 @bp.route('/ai/stop_job/<job_id>', methods=['POST'])
@@ -133,6 +147,32 @@ def stop_job(job_id):
     redis_conn.set(f"stop_job_flag_{job_id}", "1", ex=3600) # Expire in 1 hour just in case
     return jsonify({'status': 'stopping', 'message': 'Stop signal sent to job'})
 
+@bp.route('/ai/bulk/cancel/<service>', methods=['POST'])
+def cancel_bulk_run(service):
+    # Between status checks no job is running, so the stop flag goes on the submitting job the checks report to
+    submit_job_id = get_active_bulk_run(service)
+    if not submit_job_id:
+        return jsonify({'status': 'error', 'message': 'No bulk run in progress'})
+    current_app.queue.connection.set(f"stop_job_flag_{submit_job_id}", "1", ex=3600)
+    return jsonify({'status': 'stopping', 'message': 'The provider batch will be cancelled at the next status check'})
+
+@bp.route('/ai/limiter_stats')
+def limiter_stats():
+    # Live numbers come from the running scoring job; otherwise the last job's final snapshot
+    redis_conn = current_app.queue.connection
+    active_job_id = get_active_job_id(current_app.queue)
+    if active_job_id:
+        try:
+            job = Job.fetch(active_job_id, connection=redis_conn)
+            if job.meta.get('limiter'):
+                return jsonify({'source': 'running', **job.meta['limiter']})
+        except NoSuchJobError:
+            pass
+    stored = redis_conn.get(LIMITER_STATS_KEY)
+    if not stored:
+        return jsonify({})
+    return jsonify({'source': 'last_job', **json.loads(stored)})
+
 @bp.route('/ai/logs')
 def get_logs():
     try:
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, redirect, url_for, flash
 from .. import db
 from ..models import Movie, Show, ServiceSettings
-from ..tasks import update_service_tags, get_retry_session
+from ..tasks import queue_tag_update, get_retry_session
 from datetime import datetime, timedelta
 import requests
 
@@ -58,7 +58,7 @@ def media_action(media_type, media_id, action):
         'tagsToAdd': tags_to_add,
         'tagsToRemove': tags_to_remove
     }
-    update_service_tags(service_name, payload)
+    queue_tag_update(service_name, payload)
     
     # Check if the request wants JSON (AJAX/Fetch) or HTML (Standard Link)
     if request.headers.get('Accept') == 'application/json':
@@ -191,7 +191,7 @@ def bulk_action():
             'tagsToAdd': tags_to_add,
             'tagsToRemove': tags_to_remove
         }
-        update_service_tags(service_name, payload)
+        queue_tag_update(service_name, payload)
 
     return jsonify({'status': 'success', 'count': count})
 
@@ -3,6 +3,7 @@ from sqlalchemy import func
 from .. import db
 from ..models import Movie, Show, ServiceSettings
 from ..tasks import get_retry_session
+from ..http_client import get_http_stats
 import time
 
 bp = Blueprint('main', __name__)
@@ -73,3 +74,8 @@ def health_check(service):
         
     except Exception as e:
         return jsonify({'status': 'offline', 'latency': 0, 'message': str(e)})
+
+@bp.route('/http_stats')
+def http_stats():
+    # Connection pool counters for this gunicorn worker; sync job results carry the worker's own
+    return jsonify(get_http_stats())
@@ -1,15 +1,18 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, current_app, Response, stream_with_context
 from sqlalchemy import text
 from .. import db, run_migrations
 from ..models import ServiceSettings, AISettings
 from ..tasks import sync_radarr_movies, sync_sonarr_shows, sync_tautulli_history, get_retry_session, vacuum_database
+from ..job_events import job_channel, clear_active_job_id, TERMINAL_STATUSES, JOB_EVENT_HEARTBEAT, JOB_EVENT_MAX_SECONDS
 from rq.job import Job
 from rq.exceptions import NoSuchJobError
 from rq.registry import StartedJobRegistry
+import json
 import os
 import requests
 import shutil
 import sqlite3
+import time
 from datetime import datetime
 
 bp = Blueprint('settings', __name__)
@@ -31,6 +34,8 @@ def settings():
             settings.retention_days = int(request.form.get(f'{service_name}_retention_days', 365))
             if service_name == 'Radarr': # Centralized TMDB key
                 settings.tmdb_api_key = request.form.get('tmdb_api_key')
+                settings.tmdb_concurrency = max(1, int(request.form.get('tmdb_concurrency', 8)))
+                settings.tmdb_rate_limit = max(0, int(request.form.get('tmdb_rate_limit', 20)))
 
             db.session.add(settings)
         
@@ -44,12 +49,20 @@ def settings():
         ai_settings.learning_model = request.form.get('ai_learning_model')
         ai_settings.scoring_model = request.form.get('ai_scoring_model')
         ai_settings.batch_size_movies_learn = int(request.form.get('batch_size_movies_learn', 20))
-        ai_settings.batch_size_movies_score = int(request.form.get('batch_size_movies_score', 50))
         ai_settings.batch_size_shows_learn = int(request.form.get('batch_size_shows_learn', 10))
-        ai_settings.batch_size_shows_score = int(request.form.get('batch_size_shows_score', 20))
+        ai_settings.max_items_movies_score = max(0, int(request.form.get('max_items_movies_score', 0)))
+        ai_settings.max_items_shows_score = max(0, int(request.form.get('max_items_shows_score', 0)))
         ai_settings.verbose_logging = 'verbose_logging' in request.form
         ai_settings.log_retention = int(request.form.get('log_retention', 7))
         ai_settings.max_items_limit = int(request.form.get('max_items_limit', 0))
+        ai_settings.scoring_concurrency = max(1, int(request.form.get('scoring_concurrency', 4)))
+        ai_settings.requests_per_minute = max(0, int(request.form.get('requests_per_minute', 60)))
+        ai_settings.tokens_per_minute = max(0, int(request.form.get('tokens_per_minute', 0)))
+        ai_settings.scoring_token_budget = max(0, int(request.form.get('scoring_token_budget', 0)))
+        ai_settings.prompt_encoding = request.form.get('prompt_encoding', 'compact')
+        ai_settings.prescore_enabled = 'prescore_enabled' in request.form
+        ai_settings.prescore_confidence = min(99, max(50, int(request.form.get('prescore_confidence', 90))))
+        ai_settings.auto_rescore_after_sync = 'auto_rescore_after_sync' in request.form
         
         db.session.add(ai_settings)
         db.session.commit()
@@ -219,9 +232,9 @@ def sync(service):
     full_sync = mode == 'full'
 
     if service == 'radarr':
-        job = current_app.queue.enqueue(sync_radarr_movies, job_timeout='3h', args=(full_sync,))
+        job = current_app.queue.enqueue(sync_radarr_movies, job_timeout='1h', args=(full_sync,))
     elif service == 'sonarr':
-        job = current_app.queue.enqueue(sync_sonarr_shows, job_timeout='3h', args=(full_sync,))
+        job = current_app.queue.enqueue(sync_sonarr_shows, job_timeout='1h', args=(full_sync,))
     elif service == 'tautulli':
         job = current_app.queue.enqueue(sync_tautulli_history, job_timeout='5m', args=(full_sync,))
     else:
@@ -235,14 +248,13 @@ def stop_job():
     redis_conn.set('stop-job-flag', 'true')
     return jsonify({'status': 'Stop signal sent'})
 
-@bp.route('/task_status/<job_id>')
-def task_status(job_id):
+def _job_status(job_id):
     try:
         job = Job.fetch(job_id, connection=current_app.queue.connection)
     except NoSuchJobError:
         # The job is no longer in the registry, which means it's finished or failed and cleaned up.
         # Tell the frontend to stop polling.
-        return jsonify({'status': 'finished'})
+        return {'status': 'finished'}
 
     response = {
         'status': job.get_status(),
@@ -254,5 +266,57 @@ def task_status(job_id):
         response['result'] = job.result
     elif job.is_failed:
         response['error'] = job.exc_info
-    
-    return jsonify(response)
+    return response
+
+@bp.route('/task_status/<job_id>')
+def task_status(job_id):
+    return jsonify(_job_status(job_id))
+
+@bp.route('/task_events/<job_id>')
+def task_events(job_id):
+    """
+    Server-Sent Events stream of a job's status. Progress is pushed from the job's pub/sub
+    channel as the worker flushes it; the job itself is only fetched on connect and when
+    the channel has been quiet for JOB_EVENT_HEARTBEAT seconds, to detect completion.
+    """
+    redis_conn = current_app.queue.connection
+
+    def event(data):
+        return f"data: {json.dumps(data, default=str)}\n\n"
+
+    def stream():
+        pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        # Subscribe before reading the current state so no update is lost in between
+        pubsub.subscribe(job_channel(job_id))
+        try:
+            status = _job_status(job_id)
+            if status['status'] in TERMINAL_STATUSES:
+                status['already_done'] = True
+                clear_active_job_id()
+                yield event(status)
+                return
+            yield event(status)
+
+            timeout = JOB_EVENT_HEARTBEAT
+            deadline = time.monotonic() + JOB_EVENT_MAX_SECONDS
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=timeout)
+                if message is None:
+                    status = _job_status(job_id)
+                    if status['status'] in TERMINAL_STATUSES:
+                        clear_active_job_id()
+                        yield event(status)
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                data = message['data'].decode('utf-8')
+                yield f"data: {data}\n\n"
+                # The 100% update is flushed just before the job returns, so look for the result soon after
+                timeout = 1 if json.loads(data).get('progress', 0) >= 100 else JOB_EVENT_HEARTBEAT
+        finally:
+            pubsub.close()
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
@@ -0,0 +1,88 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pool and retry policy, overridable through the environment
+HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 10))     # Distinct hosts kept in the pool manager
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 16))       # Keep-alive connections kept per host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 5))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.3))
+
+class PooledSession(requests.Session):
+    """requests.Session that applies a default timeout to every request."""
+    default_timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.default_timeout)
+        return super().request(method, url, **kwargs)
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+def _build_session():
+    session = PooledSession()
+    retry = Retry(
+        total=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(500, 502, 503, 504, 429),
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_http_session():
+    """
+    Returns the process-wide pooled session. Connections are kept alive per host and
+    reused across requests and threads. The session is rebuilt after a fork so gunicorn
+    workers never share sockets with their parent; for the same reason each job run by the
+    default forking RQ worker starts with a fresh pool.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+def get_http_stats():
+    """Per-host connection reuse counters for the current process."""
+    session = get_http_session()
+    hosts = []
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts.append({
+                'host': f"{key.key_scheme}://{key.key_host}:{key.key_port}",
+                'requests': pool.num_requests,
+                'connections_opened': pool.num_connections,
+                'connections_reused': max(0, pool.num_requests - pool.num_connections),
+                'idle_connections': pool.pool.qsize() if pool.pool else 0
+            })
+
+    total_requests = sum(host['requests'] for host in hosts)
+    total_reused = sum(host['connections_reused'] for host in hosts)
+    return {
+        'pid': os.getpid(),
+        'pool_size': HTTP_POOL_SIZE,
+        'requests': total_requests,
+        'connections_reused': total_reused,
+        'reuse_ratio': round(total_reused / total_requests, 3) if total_requests else 0,
+        'hosts': hosts
+    }
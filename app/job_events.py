@@ -0,0 +1,48 @@
+import json
+import threading
+import time
+from rq.registry import StartedJobRegistry
+
+# Seconds an SSE stream waits for a progress message before re-checking the job itself.
+# Jobs that fail or finish without a final progress message are detected this way.
+JOB_EVENT_HEARTBEAT = 5
+# Streams are closed after this long; EventSource reconnects on its own
+JOB_EVENT_MAX_SECONDS = 600
+# How long a worker process trusts its last StartedJobRegistry lookup
+ACTIVE_JOB_CACHE_SECONDS = 3
+
+TERMINAL_STATUSES = ('finished', 'failed', 'stopped', 'canceled')
+
+def job_channel(job_id):
+    return f"job-progress:{job_id}"
+
+def publish_job_progress(job):
+    """Pushes the job's current progress/eta to its pub/sub channel. Called by ProgressReporter."""
+    payload = {
+        'status': 'started',
+        'progress': job.meta.get('progress', 0),
+        'eta': job.meta.get('eta'),
+        'func_name': job.func_name
+    }
+    job.connection.publish(job_channel(job.id), json.dumps(payload))
+
+_active_job = {'id': None, 'expires': 0.0}
+_active_job_lock = threading.Lock()
+
+def get_active_job_id(queue):
+    """
+    Returns the id of the running job, or None. The registry lookup is shared by every
+    page render in this process for ACTIVE_JOB_CACHE_SECONDS.
+    """
+    now = time.monotonic()
+    if now < _active_job['expires']:
+        return _active_job['id']
+    with _active_job_lock:
+        if now >= _active_job['expires']:
+            job_ids = StartedJobRegistry(queue=queue).get_job_ids()
+            _active_job['id'] = job_ids[0] if job_ids else None
+            _active_job['expires'] = time.monotonic() + ACTIVE_JOB_CACHE_SECONDS
+        return _active_job['id']
+
+def clear_active_job_id():
+    _active_job['expires'] = 0.0
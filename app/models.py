@@ -8,6 +8,8 @@ class ServiceSettings(db.Model):
     grace_days = db.Column(db.Integer, default=30)
     retention_days = db.Column(db.Integer, default=365)
     tmdb_api_key = db.Column(db.String(100))
+    tmdb_concurrency = db.Column(db.Integer, default=8)
+    tmdb_rate_limit = db.Column(db.Integer, default=20) # Requests per second
     seasonal_min_episodes = db.Column(db.Integer, default=1)
     overlay_template = db.Column(db.Text) # Deprecated
     overlay_movie_template = db.Column(db.Text)
@@ -15,6 +17,7 @@ class ServiceSettings(db.Model):
     overlay_use_tmdb_for_shows = db.Column(db.Boolean, default=False)
     ai_rules = db.Column(db.Text)
     ai_rule_proposals = db.Column(db.Text) # Stores JSON proposals for rule updates
+    history_cursor = db.Column(db.Integer) # Tautulli: highest history row_id fully synced
 
 class AISettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -23,12 +26,22 @@ class AISettings(db.Model):
     learning_model = db.Column(db.String(100), default='gemini-1.5-pro')
     scoring_model = db.Column(db.String(100), default='gemini-1.5-flash')
     batch_size_movies_learn = db.Column(db.Integer, default=20)
-    batch_size_movies_score = db.Column(db.Integer, default=50)
+    batch_size_movies_score = db.Column(db.Integer, default=50) # Unused since v0.975, see max_items_movies_score
     batch_size_shows_learn = db.Column(db.Integer, default=10)
-    batch_size_shows_score = db.Column(db.Integer, default=20)
+    batch_size_shows_score = db.Column(db.Integer, default=20) # Unused since v0.975, see max_items_shows_score
+    max_items_movies_score = db.Column(db.Integer, default=0) # Optional item cap per scoring batch, 0 = token budget only
+    max_items_shows_score = db.Column(db.Integer, default=0) # Optional item cap per scoring batch, 0 = token budget only
     verbose_logging = db.Column(db.Boolean, default=False)
     log_retention = db.Column(db.Integer, default=7)
     max_items_limit = db.Column(db.Integer, default=0)
+    scoring_concurrency = db.Column(db.Integer, default=4)
+    requests_per_minute = db.Column(db.Integer, default=60)
+    tokens_per_minute = db.Column(db.Integer, default=0)
+    scoring_token_budget = db.Column(db.Integer, default=0) # Prompt tokens per scoring batch, 0 = model default
+    prompt_encoding = db.Column(db.String(20), default='compact') # 'json', 'compact' or 'table'
+    prescore_enabled = db.Column(db.Boolean, default=False) # Score confident items with the local TF-IDF model
+    prescore_confidence = db.Column(db.Integer, default=90) # Percent
+    auto_rescore_after_sync = db.Column(db.Boolean, default=False) # Queue an incremental scoring run after each sync
 
 class Movie(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -38,13 +51,16 @@ class Movie(db.Model):
     year = db.Column(db.Integer)
     size_gb = db.Column(db.Float)
     labels = db.Column(db.String(200))
-    score = db.Column(db.String(50))
+    score = db.Column(db.String(50), index=True)
     ai_score = db.Column(db.Integer)
     marked_for_deletion_at = db.Column(db.DateTime(timezone=True))
     delete_at = db.Column(db.DateTime(timezone=True))
     overview = db.Column(db.Text)
     local_poster_path = db.Column(db.String(200))
     cast = db.Column(db.Text)
+    content_hash = db.Column(db.String(40)) # Fingerprint of the last synced *arr data
+    last_learned_at = db.Column(db.DateTime) # Last time the item was sampled for learning
+    ai_rules_hash = db.Column(db.String(40)) # Rule set version ai_score was computed under
 
 class Show(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,13 +71,35 @@ class Show(db.Model):
     year = db.Column(db.Integer)
     size_gb = db.Column(db.Float)
     labels = db.Column(db.String(200))
-    score = db.Column(db.String(50))
+    score = db.Column(db.String(50), index=True)
     ai_score = db.Column(db.Integer)
     marked_for_deletion_at = db.Column(db.DateTime(timezone=True))
     delete_at = db.Column(db.DateTime(timezone=True))
     overview = db.Column(db.Text)
     local_poster_path = db.Column(db.String(200))
     cast = db.Column(db.Text)
+    content_hash = db.Column(db.String(40)) # Fingerprint of the last synced *arr data
+    last_learned_at = db.Column(db.DateTime) # Last time the item was sampled for learning
+    ai_rules_hash = db.Column(db.String(40)) # Rule set version ai_score was computed under
+
+class PosterCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), unique=True, nullable=False) # '{media_type}_{tmdb_id}'
+    media_type = db.Column(db.String(10))
+    tmdb_id = db.Column(db.Integer)
+    poster_path = db.Column(db.String(200)) # TMDB poster_path the local file was downloaded from
+    etag = db.Column(db.String(200))
+    last_modified = db.Column(db.String(100))
+    content_hash = db.Column(db.String(64)) # SHA-256 of the image, also its file name
+    local_path = db.Column(db.String(200))
+    checked_at = db.Column(db.DateTime)
+
+class AIScoreCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(40), unique=True, nullable=False) # SHA-1 of (item fields, rules, scoring model)
+    score = db.Column(db.Integer)
+    model = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime)
 
 class TautulliHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,169 @@
+import re
+import logging
+from collections import Counter
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Both classes need at least this many labelled items before the pre-scorer is trusted
+MIN_TRAINING_ITEMS = 20
+# Vocabulary size cap; terms are ranked by how many training items contain them
+MAX_FEATURES = 5000
+# Terms found in fewer training items than this are ignored
+MIN_DOCUMENT_FREQUENCY = 2
+# Share of the labelled items held back to check the model before it is used
+HOLDOUT_FRACTION = 0.2
+# Held-out items the model must be confident about before its accuracy on them is trusted
+MIN_CONFIDENT_HOLDOUT = 10
+# Rows scored per NumPy matrix product when predicting
+PREDICT_CHUNK_SIZE = 1000
+
+POSITIVE_SCORES = ('Keep', 'Tautulli Keep')
+NEGATIVE_SCORES = ('Delete',)
+
+# Prefix of the tags the app itself writes for Keep/Delete/Tautulli Keep items
+APP_TAG_PREFIX = 'ai-'
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has he her his in is it its of on or she that the their they this to was were when who will with".split()
+)
+
+def item_terms(item):
+    """
+    Bag of terms for one Movie/Show, or a column row with the same names: overview and
+    title words, plus whole labels, cast names and the release decade as single prefixed terms.
+    The app's own ai-* tags are left out; they mirror the score being predicted.
+    """
+    terms = [word for word in WORD_RE.findall(f"{item.title or ''} {item.overview or ''}".lower()) if word not in STOP_WORDS and len(word) > 1]
+    labels = (label.strip().lower() for label in (item.labels or '').split(','))
+    terms.extend(f"label:{label}" for label in labels if label and not label.startswith(APP_TAG_PREFIX))
+    terms.extend(f"cast:{name.strip().lower()}" for name in (item.cast or '').split(',') if name.strip())
+    if item.year:
+        terms.append(f"decade:{item.year // 10 * 10}")
+    return terms
+
+class TfidfPrescorer:
+    """
+    Offline keep/delete classifier: TF-IDF vectors over item_terms() and a class-balanced,
+    L2-regularised logistic regression fitted with NumPy. The TF-IDF matrix is kept sparse
+    (row, column, value arrays), so memory grows with the number of terms per item rather
+    than items x vocabulary. predict() returns the probability that the user would keep each item.
+    """
+    def __init__(self, max_features=MAX_FEATURES, min_df=MIN_DOCUMENT_FREQUENCY, l2=1e-3, iterations=300, learning_rate=2.0):
+        self.max_features = max_features
+        self.min_df = min_df
+        self.l2 = l2
+        self.iterations = iterations
+        self.learning_rate = learning_rate
+        self.vocabulary = {}
+        self.idf = None
+        self.weights = None
+        self.bias = 0.0
+
+    def _vectorize(self, documents):
+        """L2-normalised TF-IDF rows as a sparse (rows, columns, values) triple."""
+        rows, columns, counts = [], [], []
+        for row, terms in enumerate(documents):
+            for term, count in Counter(terms).items():
+                column = self.vocabulary.get(term)
+                if column is not None:
+                    rows.append(row)
+                    columns.append(column)
+                    counts.append(count)
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        values = (1.0 + np.log(np.asarray(counts, dtype=np.float32))) * self.idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(documents)))
+        norms[norms == 0] = 1.0
+        return rows, columns, (values / norms[rows]).astype(np.float32)
+
+    @staticmethod
+    def _dot(matrix, weights, row_count):
+        """Sparse matrix times weight vector: one score per row."""
+        rows, columns, values = matrix
+        return np.bincount(rows, weights=values * weights[columns], minlength=row_count).astype(np.float32)
+
+    def fit(self, documents, labels):
+        document_frequency = Counter(term for terms in documents for term in set(terms))
+        terms = [term for term, frequency in document_frequency.most_common(self.max_features) if frequency >= self.min_df]
+        self.vocabulary = {term: column for column, term in enumerate(terms)}
+        frequencies = np.array([document_frequency[term] for term in terms], dtype=np.float32)
+        self.idf = np.log((1 + len(documents)) / (1 + frequencies)) + 1.0
+
+        X = self._vectorize(documents)
+        rows, columns, values = X
+        y = np.asarray(labels, dtype=np.float32)
+        # Balance the classes so a library with far more keeps than deletes is not all "keep"
+        positives = max(y.sum(), 1.0)
+        negatives = max(len(y) - y.sum(), 1.0)
+        sample_weights = np.where(y == 1, len(y) / (2 * positives), len(y) / (2 * negatives)).astype(np.float32)
+
+        self.weights = np.zeros(len(self.vocabulary), dtype=np.float32)
+        self.bias = 0.0
+        for _ in range(self.iterations):
+            error = (self._sigmoid(self._dot(X, self.weights, len(y)) + self.bias) - y) * sample_weights
+            gradient = np.bincount(columns, weights=values * error[rows], minlength=len(self.vocabulary)).astype(np.float32)
+            self.weights -= self.learning_rate * (gradient / len(y) + self.l2 * self.weights)
+            self.bias -= self.learning_rate * float(error.mean())
+        return self
+
+    def predict(self, documents):
+        probabilities = []
+        for start in range(0, len(documents), PREDICT_CHUNK_SIZE):
+            chunk = documents[start:start + PREDICT_CHUNK_SIZE]
+            probabilities.append(self._sigmoid(self._dot(self._vectorize(chunk), self.weights, len(chunk)) + self.bias))
+        return np.concatenate(probabilities) if probabilities else np.zeros(0, dtype=np.float32)
+
+    @staticmethod
+    def _sigmoid(values):
+        return 1.0 / (1.0 + np.exp(-np.clip(values, -30, 30)))
+
+def train_prescorer(ModelClass, confidence):
+    """
+    Fits a TfidfPrescorer on the library's Keep/Tautulli Keep and Delete items and checks it
+    on a held-out share. Returns the fitted model, or None when there are too few labelled
+    items, it is confident about fewer than MIN_CONFIDENT_HOLDOUT held-out items, or those
+    are right less often than `confidence`.
+    """
+    rows = ModelClass.query.with_entities(
+        ModelClass.title, ModelClass.year, ModelClass.overview, ModelClass.labels, ModelClass.cast, ModelClass.score
+    ).filter(ModelClass.score.in_(POSITIVE_SCORES + NEGATIVE_SCORES)).all()
+    documents = [item_terms(item) for item in rows]
+    labels = np.array([1 if item.score in POSITIVE_SCORES else 0 for item in rows])
+    positives = int(labels.sum())
+    if positives < MIN_TRAINING_ITEMS or len(labels) - positives < MIN_TRAINING_ITEMS:
+        logger.info(f"Pre-scorer skipped: {positives} kept and {len(labels) - positives} deleted items, {MIN_TRAINING_ITEMS} of each needed")
+        return None
+
+    # Fixed seed so the same library always gets the same split
+    order = np.random.default_rng(0).permutation(len(labels))
+    holdout_size = max(1, int(len(labels) * HOLDOUT_FRACTION))
+    holdout, training = order[:holdout_size], order[holdout_size:]
+    model = TfidfPrescorer().fit([documents[i] for i in training], labels[training])
+    probabilities = model.predict([documents[i] for i in holdout])
+    confident = (probabilities >= confidence) | (probabilities <= 1 - confidence)
+    confident_count = int(confident.sum())
+    if confident_count < MIN_CONFIDENT_HOLDOUT:
+        logger.info(f"Pre-scorer skipped: confident on {confident_count}/{holdout_size} held-out items, {MIN_CONFIDENT_HOLDOUT} needed")
+        return None
+    precision = float(((probabilities[confident] >= 0.5) == (labels[holdout][confident] == 1)).mean())
+    logger.info(f"Pre-scorer holdout: {confident_count}/{holdout_size} confident, {precision:.0%} correct")
+    if precision < confidence:
+        logger.info("Pre-scorer skipped: holdout precision below the confidence threshold")
+        return None
+
+    # Refit on every labelled item now that the model has passed the check
+    return TfidfPrescorer().fit(documents, labels)
+
+def prescore_items(model, items, confidence):
+    """
+    Returns {index: score} for the items the model is confident about, scores being the keep
+    probability on the 0-100 scale the AI uses. Everything else is left for the LLM.
+    """
+    probabilities = model.predict([item_terms(item) for item in items])
+    return {
+        index: int(round(float(probability) * 100))
+        for index, probability in enumerate(probabilities)
+        if probability >= confidence or probability <= 1 - confidence
+    }
@@ -2,4 +2,5 @@ from .radarr import sync_radarr_movies
 from .sonarr import sync_sonarr_shows
 from .tautulli import sync_tautulli_history
 from .maintenance import vacuum_database
+from .tags import queue_tag_update, propagate_tag_changes
 from .utils import update_service_tags, fetch_tmdb_assets, get_retry_session
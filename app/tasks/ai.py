@@ -1,8 +1,19 @@
 from .. import db
-from ..models import Movie, Show, ServiceSettings, AISettings
-from ..ai_service import AIService
+from ..models import Movie, Show, ServiceSettings, AISettings, AIScoreCache
+from ..ai_service import AIService, truncate_overview
+from .utils import ProgressReporter, bulk_upsert, bulk_update, iter_keyset_windows, chunked, SQL_IN_CHUNK_SIZE
+from ..ai_limiter import LIMITER_STATS_KEY
+from ..ai_batch import BATCH_COMPLETED, BATCH_FAILED
+from ..prescorer import train_prescorer, prescore_items
+from .sampling import sample_for_learning, SAMPLE_CLASSES
+from flask import current_app
 from rq import get_current_job
-from sqlalchemy import func
+from sqlalchemy import or_
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from datetime import datetime, timedelta
+import hashlib
+import itertools
+import math
 import time
 import logging
 import json
@@ -12,11 +23,29 @@ import uuid
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def learn_user_preferences(service_name):
-    print(f"Starting learning task for {service_name}")
+# Upper bound on batches in flight when AISettings.scoring_concurrency is not set.
+# The AIService limiter lowers the effective concurrency while the provider throttles.
+DEFAULT_SCORING_CONCURRENCY = 4
+# Seconds between status checks of a provider batch job in bulk mode
+BULK_POLL_SECONDS = 30
+# Submitted bulk runs are forgotten after this long; provider batch jobs end within 24h
+BULK_STATE_TTL = 48 * 3600
+# Consecutive failed status checks after which a bulk run is given up
+BULK_POLL_MAX_ERRORS = 10
+# Most shards a full-history learning run splits the labelled items into
+MAX_LEARNING_SHARDS = 20
+# Shard proposal sets merged per consolidation call; more are merged over several rounds
+CONSOLIDATION_FAN_IN = 8
+# Items with these scores were decided by the user (or are managed elsewhere) and are never AI scored
+EXCLUDED_SCORES = ['Keep', 'Delete', 'Tautulli Keep', 'Seasonal', 'Archived']
+# Keep probability (in percent, or 100 minus it for deletes) the local pre-scorer needs before it skips the LLM
+DEFAULT_PRESCORE_CONFIDENCE = 90
+
+def learn_user_preferences(service_name, full_history=False):
+    print(f"Starting learning task for {service_name} (Full history: {full_history})")
     job = get_current_job()
-    job.meta['progress'] = 0
-    job.save_meta()
+    progress = ProgressReporter(job)
+    progress.flush()
     
     ai_settings = AISettings.query.first()
     if not ai_settings or not ai_settings.api_key:
@@ -40,20 +69,6 @@ def learn_user_preferences(service_name):
 
     print(f"Fetching samples with batch size {batch_size}")
     
-    # Fetch samples using random ordering
-    # Include 'Tautulli Keep' as a positive signal along with 'Keep'
-    kept_items = ModelClass.query.filter(
-        ModelClass.score.in_(['Keep', 'Tautulli Keep'])
-    ).order_by(func.random()).limit(batch_size).all()
-    
-    deleted_items = ModelClass.query.filter_by(score='Delete').order_by(func.random()).limit(batch_size).all()
-    
-    print(f"Found {len(kept_items)} kept/tautulli-kept items and {len(deleted_items)} deleted items")
-
-    if not kept_items and not deleted_items:
-        print("No history found to learn from.")
-        return {'error': 'No history found to learn from.'}
-
     # Prepare data for AI
     def serialize(item):
         return {
@@ -63,16 +78,47 @@ def learn_user_preferences(service_name):
             'labels': item.labels,
             'status': item.score # Include status so AI knows if it was explicit Keep or Tautulli Keep
         }
-        
-    kept_data = [serialize(item) for item in kept_items]
-    deleted_data = [serialize(item) for item in deleted_items]
+
+    # Fetch stratified samples (decade, label, size), preferring items not shown to the model before.
+    # Include 'Tautulli Keep' as a positive signal along with 'Keep'
+    redis_conn = job.connection
+    if full_history:
+        # Every labelled item goes into exactly one shard: each class is drawn once, without
+        # replacement, and dealt round-robin into ceil(class size / shard count) slices. Shards
+        # hold about one learn batch per class until the larger class exceeds MAX_LEARNING_SHARDS
+        # batches; past that they grow instead of leaving items out.
+        class_counts = {name: ModelClass.query.filter(ModelClass.score.in_(scores)).count() for name, scores in SAMPLE_CLASSES.items()}
+        shard_count = min(MAX_LEARNING_SHARDS, max(1, math.ceil(max(class_counts.values()) / max(batch_size, 1))))
+        print(f"Full history: {class_counts['keep']} kept and {class_counts['delete']} deleted items in {shard_count} shards")
+        kept_items = sample_for_learning(redis_conn, service_name, ModelClass, 'keep', class_counts['keep'])
+        deleted_items = sample_for_learning(redis_conn, service_name, ModelClass, 'delete', class_counts['delete'])
+        shards = [
+            ([serialize(item) for item in kept_items[index::shard_count]], [serialize(item) for item in deleted_items[index::shard_count]])
+            for index in range(shard_count)
+        ]
+        shards = [shard for shard in shards if shard[0] or shard[1]]
+    else:
+        kept_items = sample_for_learning(redis_conn, service_name, ModelClass, 'keep', batch_size)
+        deleted_items = sample_for_learning(redis_conn, service_name, ModelClass, 'delete', batch_size)
+        shards = [([serialize(item) for item in kept_items], [serialize(item) for item in deleted_items])] if kept_items or deleted_items else []
+    db.session.commit()
     
+    print(f"Found {sum(len(kept) for kept, _ in shards)} kept/tautulli-kept items and {sum(len(deleted) for _, deleted in shards)} deleted items in {len(shards)} shard(s)")
+
+    if not shards:
+        print("No history found to learn from.")
+        return {'error': 'No history found to learn from.'}
+
     current_rules = service_settings.ai_rules or ""
+    concurrency = max(1, ai_settings.scoring_concurrency or DEFAULT_SCORING_CONCURRENCY)
     
     try:
         print("Calling AI service to generate rule proposals...")
-        # Now returns a JSON string representing the proposals
-        proposals_json = ai_service.generate_rules(kept_data, deleted_data, current_rules)
+        if len(shards) == 1:
+            # Now returns a JSON string representing the proposals
+            proposals_json = ai_service.generate_rules(shards[0][0], shards[0][1], current_rules)
+        else:
+            proposals_json = json.dumps(learn_in_shards(ai_service, shards, current_rules, concurrency, progress))
         print(f"Generated proposals: {proposals_json}")
         
         # Validate that it's valid JSON and add IDs
@@ -107,10 +153,300 @@ def learn_user_preferences(service_name):
         print(f"Error generating rules: {str(e)}")
         return {'error': str(e)}
 
-def score_media_items(service_name, resume_mode=False):
+def merge_proposals(proposal_sets):
+    """Plain concatenation of proposal sets, dropping repeated rules; used when consolidation fails."""
+    merged = {'refinements': [], 'new_rules': []}
+    seen = set()
+    for proposals in proposal_sets:
+        for kind, field in (('refinements', 'new_rule'), ('new_rules', 'rule')):
+            for entry in proposals.get(kind, []):
+                text = str(entry.get(field, '')).strip().lower()
+                if text and (kind, text) not in seen:
+                    seen.add((kind, text))
+                    merged[kind].append(entry)
+    return merged
+
+def iter_parallel(fn, args_list, concurrency):
+    """Runs fn over args_list on a thread pool; yields (index, result, error) as calls finish."""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(fn, *args): index for index, args in enumerate(args_list)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+def learn_in_shards(ai_service, shards, current_rules, concurrency, progress):
+    """
+    Map-reduce learning: generate_rules runs on every (kept, deleted) shard in parallel, then
+    consolidate_rules merges the shard proposals CONSOLIDATION_FAN_IN at a time, round after
+    round, until a single proposal set is left. Returns it as a dict.
+    """
+    rounds = max(1, math.ceil(math.log(len(shards), CONSOLIDATION_FAN_IN)))
+    progress.start(len(shards) + rounds)
+
+    proposal_sets = []
+    for index, proposals_json, error in iter_parallel(
+        lambda kept, deleted: ai_service.generate_rules(kept, deleted, current_rules), shards, concurrency
+    ):
+        progress.update()
+        if error is not None:
+            print(f"Error learning shard {index + 1}/{len(shards)}: {str(error)}")
+            continue
+        try:
+            proposal_sets.append(json.loads(proposals_json))
+            print(f"Shard {index + 1}/{len(shards)} learned")
+        except json.JSONDecodeError:
+            print(f"Shard {index + 1}/{len(shards)} returned invalid JSON, skipping")
+
+    if not proposal_sets:
+        raise Exception('No shard returned usable rule proposals')
+
+    while len(proposal_sets) > 1:
+        groups = [proposal_sets[start:start + CONSOLIDATION_FAN_IN] for start in range(0, len(proposal_sets), CONSOLIDATION_FAN_IN)]
+        print(f"Consolidating {len(proposal_sets)} proposal sets in {len(groups)} group(s)")
+        merged = [None] * len(groups)
+        for index, proposals_json, error in iter_parallel(
+            lambda group: ai_service.consolidate_rules(group, current_rules) if len(group) > 1 else json.dumps(group[0]),
+            [(group,) for group in groups], concurrency
+        ):
+            try:
+                if error is not None:
+                    raise error
+                merged[index] = json.loads(proposals_json)
+            except Exception as e:
+                print(f"Consolidation failed ({str(e)}), merging group {index + 1} without the AI")
+                merged[index] = merge_proposals(groups[index])
+        proposal_sets = merged
+        progress.update()
+
+    return proposal_sets[0]
+
+def rules_version(rules):
+    """Fingerprint of a rule set, stored with every ai_score as ai_rules_hash."""
+    return hashlib.sha1((rules or '').strip().encode('utf-8')).hexdigest()
+
+def stale_items_filter(ModelClass, rules):
+    """Items never scored (new since the last run) or scored under a different rule set."""
+    return or_(ModelClass.ai_rules_hash == None, ModelClass.ai_rules_hash != rules_version(rules))
+
+def count_stale_items(service_name, rules):
+    ModelClass = Movie if service_name == 'Radarr' else Show
+    return ModelClass.query.filter(ModelClass.score.notin_(EXCLUDED_SCORES), stale_items_filter(ModelClass, rules)).count()
+
+def queue_incremental_rescore(service_name):
+    """
+    Called at the end of a sync. When "Rescore After Sync" is on, enqueues an incremental
+    scoring run if the service has rules and stale items. Returns the job id or None.
+    """
+    ai_settings = AISettings.query.first()
+    if not ai_settings or not ai_settings.api_key or not ai_settings.auto_rescore_after_sync:
+        return None
+    service_settings = ServiceSettings.query.filter_by(service_name=service_name).first()
+    if not service_settings or not service_settings.ai_rules:
+        return None
+    stale = count_stale_items(service_name, service_settings.ai_rules)
+    if not stale:
+        return None
+    print(f"Queueing incremental rescore of {stale} {service_name} items")
+    job = current_app.queue.enqueue(score_media_items, service_name, incremental=True, job_timeout=1200)
+    return job.get_id()
+
+def score_cache_key(item_data, rules, model):
+    """
+    Cache key for one item's score: its prompt fields (not its id, so identical items
+    share an entry), the rules text and the scoring model. Any change to one of them
+    is a miss and goes back to the provider.
+    """
+    fields = {field: value for field, value in item_data.items() if field != 'id'}
+    payload = json.dumps([fields, rules, model], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def load_cached_scores(cache_keys):
+    """Returns {cache_key: score} for the keys already in AIScoreCache."""
+    cached = {}
+    for keys in chunked(sorted(set(cache_keys)), SQL_IN_CHUNK_SIZE):
+        for key, score in db.session.query(AIScoreCache.key, AIScoreCache.score).filter(AIScoreCache.key.in_(keys)):
+            cached[key] = score
+    return cached
+
+def iter_scored_batches(ai_service, batches, rules, concurrency):
+    """
+    Scores (items_map, items_data) batches with up to `concurrency` LLM calls in flight;
+    AIService's limiter decides how many of them may actually call the provider. Yields
+    (items_map, scores, error) in completion order; worker threads only see the plain
+    items_data dicts, so all database work stays with the caller.
+    """
+    def worker(items_data):
+        logger.debug("Calling AI service to score items...")
+        return ai_service.score_items(items_data, rules)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = {}
+    queue = iter(batches)
+    try:
+        for items_map, items_data in itertools.islice(queue, concurrency):
+            pending[executor.submit(worker, items_data)] = items_map
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                items_map = pending.pop(future)
+                for next_map, next_data in itertools.islice(queue, 1):
+                    pending[executor.submit(worker, next_data)] = next_map
+                try:
+                    yield items_map, future.result(), None
+                except Exception as e:
+                    yield items_map, None, e
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def apply_scores(ModelClass, items_map, scores, rules_hash, scoring_model):
+    """
+    Writes one scored batch: the item rows (by primary key) and their AIScoreCache entries.
+    items_map maps the item ids sent to the AI to (primary key, cache key). Returns the
+    number of items that got a score; the caller commits.
+    """
+    updates = []
+    cache_rows = []
+    for item_id, score in scores.items():
+        item_id_str = str(item_id)
+        if item_id_str in items_map:
+            primary_key, cache_key = items_map[item_id_str]
+            try:
+                updates.append({'id': primary_key, 'ai_score': int(score), 'ai_rules_hash': rules_hash})
+                cache_rows.append({
+                    'key': cache_key,
+                    'score': int(score),
+                    'model': scoring_model,
+                    'created_at': datetime.now()
+                })
+                logger.debug(f"Scored {item_id_str}: {score}")
+            except (ValueError, TypeError):
+                logger.warning(f"Invalid score value for item {item_id_str}: {score}")
+
+    bulk_update(ModelClass, updates)
+    bulk_upsert(AIScoreCache, 'key', cache_rows)
+    return len(updates)
+
+def _bulk_state_key(submit_job_id):
+    return f"bulk-scoring:{submit_job_id}"
+
+def _bulk_active_key(service_name):
+    return f"bulk-scoring-active:{service_name}"
+
+def schedule_bulk_poll(submit_job_id):
+    """Enqueues the next poll_bulk_scoring check BULK_POLL_SECONDS from now. Needs a worker running the RQ scheduler."""
+    poll_job = current_app.queue.enqueue_in(timedelta(seconds=BULK_POLL_SECONDS), poll_bulk_scoring, submit_job_id, job_timeout=1200)
+    return poll_job.get_id()
+
+def poll_bulk_scoring(submit_job_id):
+    """
+    One status check of the provider batch jobs submitted by a bulk scoring run. While any
+    of them is still running it schedules the next check and returns, so the worker is only
+    held for a few seconds per check; the check that finds them all finished applies the
+    results. A provider error schedules a retry, up to BULK_POLL_MAX_ERRORS in a row. A stop
+    request for the submitting job, this check or the service's bulk run cancels the provider
+    jobs instead.
+    """
+    job = get_current_job()
+    redis_conn = job.connection
+    state_key = _bulk_state_key(submit_job_id)
+    raw_state = redis_conn.get(state_key)
+    if not raw_state:
+        logger.error(f"No bulk scoring run found for job {submit_job_id}")
+        return {'error': f'No bulk scoring run found for job {submit_job_id}'}
+    state = json.loads(raw_state)
+
+    ai_settings = AISettings.query.first()
+    if not ai_settings or not ai_settings.api_key:
+        logger.error("AI not configured")
+        return {'error': 'AI not configured'}
+    ai_service = AIService(ai_settings)
+    backend = ai_service.batch_backend()
+    batch_ids = state['batch_ids']
+    active_key = _bulk_active_key(state['service_name'])
+
+    # The submit job is long gone by now, so the dashboard may have stopped this check job instead
+    stop_flags = [f"stop_job_flag_{submit_job_id}", f"stop_job_flag_{job.id}"]
+    if any(redis_conn.exists(stop_flag) for stop_flag in stop_flags):
+        for batch_id in batch_ids:
+            logger.info(f"Cancelling provider batch {batch_id}")
+            try:
+                backend.cancel(batch_id)
+            except Exception as e:
+                logger.warning(f"Could not cancel provider batch {batch_id}: {str(e)}")
+        redis_conn.delete(*stop_flags, state_key, active_key)
+        return {'status': 'stopped', 'message': f'Bulk scoring stopped by user; {len(batch_ids)} provider batch jobs cancelled'}
+
+    progress = ProgressReporter(job)
+    ModelClass = Movie if state['service_name'] == 'Radarr' else Show
+    items_maps = state['items_maps']
+    scored = state.get('scored', 0)
+    try:
+        states = {}
+        completed = 0
+        total = 0
+        for batch_id in batch_ids:
+            states[batch_id], batch_completed, batch_total = backend.poll(batch_id)
+            completed += batch_completed
+            total += batch_total
+        state['errors'] = 0
+
+        status = f"Waiting for provider batch: {completed}/{total or state['requests']} requests"
+        if any(batch_state not in (BATCH_COMPLETED, BATCH_FAILED) for batch_state in states.values()):
+            redis_conn.set(state_key, json.dumps(state), ex=BULK_STATE_TTL)
+            next_poll_id = schedule_bulk_poll(submit_job_id)
+            progress.update(status=status, batch_ids=batch_ids)
+            progress.flush()
+            logger.info(f"{status}; next check in {BULK_POLL_SECONDS}s")
+            return {'status': 'waiting', 'message': status, 'next_poll_job_id': next_poll_id}
+
+        # Every provider job has ended: apply what came back, then forget the run
+        progress.start(state['requests'])
+        for batch_id in batch_ids:
+            if states[batch_id] == BATCH_FAILED:
+                logger.error(f"Provider batch {batch_id} did not complete")
+                continue
+            results = ai_service.bulk_scoring_results(batch_id, {custom_id: list(items_map) for custom_id, items_map in items_maps.items()})
+            for custom_id, scores in results.items():
+                if custom_id in items_maps:
+                    scored += apply_scores(ModelClass, items_maps.pop(custom_id), scores, state['rules_hash'], state['scoring_model'])
+                    db.session.commit()
+                    state['scored'] = scored
+                    progress.update(done=state['requests'] - len(items_maps))
+    except Exception as e:
+        db.session.rollback()
+        # Already applied requests were removed from items_maps, so a retry only fetches the rest
+        state['errors'] = state.get('errors', 0) + 1
+        if state['errors'] >= BULK_POLL_MAX_ERRORS:
+            logger.error(f"Giving up on provider batches {', '.join(batch_ids)} after {state['errors']} failed checks: {str(e)}")
+            redis_conn.delete(state_key, active_key)
+            return {'error': f"Bulk scoring gave up after {state['errors']} failed status checks: {str(e)}"}
+        redis_conn.set(state_key, json.dumps(state), ex=BULK_STATE_TTL)
+        next_poll_id = schedule_bulk_poll(submit_job_id)
+        logger.warning(f"Checking provider batches failed ({state['errors']}/{BULK_POLL_MAX_ERRORS}): {str(e)}. Retrying in {BULK_POLL_SECONDS}s")
+        return {'status': 'retrying', 'message': f'Status check failed: {str(e)}', 'next_poll_job_id': next_poll_id}
+
+    for custom_id in items_maps:
+        logger.error(f"No result for {custom_id} in provider batches {', '.join(batch_ids)}")
+    redis_conn.delete(state_key, active_key)
+    progress.finish()
+
+    message = f"Bulk scoring applied {scored} scores from {len(batch_ids)} provider batch jobs"
+    if items_maps:
+        message += f"; {len(items_maps)} requests returned no result"
+    logger.info(message)
+    return {'status': 'success', 'message': message, 'scored': scored, 'failed_requests': len(items_maps)}
+
+def get_active_bulk_run(service_name):
+    """Id of the scoring job whose provider batch jobs are still being waited on, or None."""
+    submit_job_id = current_app.queue.connection.get(_bulk_active_key(service_name))
+    return submit_job_id.decode() if submit_job_id else None
+
+def score_media_items(service_name, resume_mode=False, bulk=False, incremental=False):
     job = get_current_job()
-    job.meta['progress'] = 0
-    job.save_meta()
+    progress = ProgressReporter(job)
+    progress.flush()
     
     ai_settings = AISettings.query.first()
     if not ai_settings or not ai_settings.api_key:
@@ -123,7 +459,7 @@ def score_media_items(service_name, resume_mode=False):
     else:
         logger.setLevel(logging.INFO)
         
-    logger.info(f"Starting scoring task for {service_name} (Resume: {resume_mode})")
+    logger.info(f"Starting scoring task for {service_name} (Resume: {resume_mode}, Bulk: {bulk}, Incremental: {incremental})")
     
     service_settings = ServiceSettings.query.filter_by(service_name=service_name).first()
     if not service_settings or not service_settings.ai_rules:
@@ -134,111 +470,207 @@ def score_media_items(service_name, resume_mode=False):
     
     if service_name == 'Radarr':
         ModelClass = Movie
-        batch_size = ai_settings.batch_size_movies_score
+        max_batch_items = ai_settings.max_items_movies_score
     else:
         ModelClass = Show
-        batch_size = ai_settings.batch_size_shows_score
+        max_batch_items = ai_settings.max_items_shows_score
 
-    logger.info(f"Fetching items with batch size {batch_size}")
-    
-    excluded_scores = ['Keep', 'Delete', 'Tautulli Keep', 'Seasonal', 'Archived']
+    logger.info(f"Fetching items; batches are sized by the prompt token budget (item cap: {max_batch_items or 'none'})")
     
-    # Build Query
-    query = ModelClass.query.filter(ModelClass.score.notin_(excluded_scores))
+    # Build Query (column rows only; nothing is loaded into the session identity map)
+    item_id_column = ModelClass.radarr_id if service_name == 'Radarr' else ModelClass.sonarr_id
+    query = ModelClass.query.with_entities(
+        ModelClass.id, item_id_column, ModelClass.title, ModelClass.year,
+        ModelClass.overview, ModelClass.labels, ModelClass.cast
+    ).filter(ModelClass.score.notin_(EXCLUDED_SCORES))
     
     if resume_mode:
         query = query.filter(ModelClass.ai_score == None)
+
+    # Incremental runs only touch items added since the last run or scored under older rules
+    if incremental:
+        query = query.filter(stale_items_filter(ModelClass, service_settings.ai_rules))
         
+    total_items = query.count()
+    
     # Apply Max Items Limit
     if ai_settings.max_items_limit > 0:
         logger.info(f"Applying Max Items Limit: {ai_settings.max_items_limit}")
-        query = query.limit(ai_settings.max_items_limit)
-    
-    # Fetch all IDs first to ensure stability
-    all_items = query.all()
-    total_items = len(all_items)
+        total_items = min(total_items, ai_settings.max_items_limit)
     
     logger.info(f"Found {total_items} items to score")
 
     if total_items == 0:
         return {'status': 'success', 'message': 'No items found to score'}
 
-    processed_count = 0
     start_time = time.time()
+    progress.start(total_items)
     redis_conn = job.connection
+
+    rules = service_settings.ai_rules
+    rules_hash = rules_version(rules)
+    scoring_model = f"{ai_settings.provider}:{ai_settings.scoring_model}"
+    counts = {'processed': 0, 'cache_hits': 0, 'cache_misses': 0, 'prescored': 0}
+
+    # Optional offline pass: items the local keep/delete model is sure about never reach the LLM
+    prescorer = None
+    if ai_settings.prescore_enabled:
+        confidence = (ai_settings.prescore_confidence or DEFAULT_PRESCORE_CONFIDENCE) / 100
+        prescorer = train_prescorer(ModelClass, confidence)
     
-    # Process in batches
-    for i in range(0, total_items, batch_size):
-        # Check Stop Flag
-        if redis_conn.exists(f"stop_job_flag_{job.id}"):
+    concurrency = max(1, ai_settings.scoring_concurrency or DEFAULT_SCORING_CONCURRENCY)
+    if not bulk:
+        logger.info(f"Scoring with up to {concurrency} batches in flight ({ai_settings.requests_per_minute or 'unlimited'} requests/minute, {ai_settings.tokens_per_minute or 'unlimited'} tokens/minute)")
+
+    # Item id -> (primary key, cache key) for items handed to the AI and not yet scored
+    pending = {}
+
+    def iter_misses():
+        # Candidates are read one keyset window at a time. Cache hits and confident pre-scores
+        # are written straight away; the remaining items are yielded for the AI.
+        for window in iter_keyset_windows(query, ModelClass.id, limit=ai_settings.max_items_limit):
+            prepared = []
+            for row in window:
+                item_data = {
+                    'id': getattr(row, item_id_column.key),
+                    'title': row.title,
+                    'year': row.year,
+                    'overview': truncate_overview(row.overview),
+                    'labels': row.labels
+                }
+                prepared.append((row, item_data, score_cache_key(item_data, rules, scoring_model)))
+
+            # Unchanged items under unchanged rules and model are served from the cache
+            cached_scores = load_cached_scores(cache_key for _, _, cache_key in prepared)
+            updates = []
+            misses = []
+            for row, item_data, cache_key in prepared:
+                if cache_key in cached_scores:
+                    updates.append({'id': row.id, 'ai_score': cached_scores[cache_key], 'ai_rules_hash': rules_hash})
+                else:
+                    misses.append((row, item_data, cache_key))
+            counts['cache_hits'] += len(updates)
+            counts['cache_misses'] += len(misses)
+
+            if prescorer is not None and misses:
+                prescores = prescore_items(prescorer, [row for row, _, _ in misses], confidence)
+                updates.extend({'id': misses[index][0].id, 'ai_score': score, 'ai_rules_hash': rules_hash} for index, score in prescores.items())
+                misses = [miss for index, miss in enumerate(misses) if index not in prescores]
+                counts['prescored'] += len(prescores)
+
+            bulk_update(ModelClass, updates)
+            db.session.commit()
+            counts['processed'] += len(updates)
+            progress.update(done=counts['processed'])
+
+            for row, item_data, cache_key in misses:
+                pending[str(item_data['id'])] = (row.id, cache_key)
+                yield item_data
+
+    def prepare_batches():
+        # Runs on this thread as the pool asks for more work, so database access never crosses threads.
+        # Batches are packed up to the prompt token budget; the optional max items setting caps the item count.
+        for items_data in ai_service.plan_scoring_batches(iter_misses(), rules, ai_settings.scoring_token_budget, max_batch_items):
+            items_map = {str(item_data['id']): pending.pop(str(item_data['id'])) for item_data in items_data}
+            yield items_map, items_data
+
+    stop_flag = f"stop_job_flag_{job.id}"
+
+    if bulk:
+        # The misses go out as provider batch jobs. This job ends once they are submitted;
+        # poll_bulk_scoring checks on them from short scheduled jobs and applies the results.
+        items_maps = {}
+        requests = []
+        for index, (items_map, items_data) in enumerate(prepare_batches()):
+            custom_id = f"batch-{index}"
+            items_maps[custom_id] = items_map
+            requests.append((custom_id, items_data))
+
+        cache_hits, cache_misses, prescored = counts['cache_hits'], counts['cache_misses'], counts['prescored']
+        logger.info(f"Score cache: {cache_hits} hits, {cache_misses} misses. Pre-scorer: {prescored} scored locally")
+        if redis_conn.exists(stop_flag):
             logger.info("Stop flag detected. Gracefully stopping task.")
-            redis_conn.delete(f"stop_job_flag_{job.id}")
-            return {'status': 'stopped', 'message': f'Scoring stopped by user at {processed_count}/{total_items}'}
+            redis_conn.delete(stop_flag)
+            return {'status': 'stopped', 'message': f"Scoring stopped by user at {counts['processed']}/{total_items}", 'cache_hits': cache_hits, 'cache_misses': cache_misses, 'prescored': prescored}
+        if not requests:
+            progress.finish()
+            return {'status': 'success', 'message': f'Scored {total_items} items ({cache_hits} from cache, {prescored} pre-scored locally)', 'cache_hits': cache_hits, 'cache_misses': cache_misses, 'prescored': prescored}
 
-        batch_items = all_items[i : i + batch_size]
+        batch_ids = ai_service.submit_bulk_scoring(requests, rules, f"{service_name.lower()}-scoring-{job.id}")
+        logger.info(f"Submitted {len(requests)} scoring requests as provider batches {', '.join(batch_ids)}")
+        state = {
+            'service_name': service_name,
+            'batch_ids': batch_ids,
+            'items_maps': items_maps,
+            'requests': len(requests),
+            'rules_hash': rules_hash,
+            'scoring_model': scoring_model
+        }
+        redis_conn.set(_bulk_state_key(job.id), json.dumps(state), ex=BULK_STATE_TTL)
+        redis_conn.set(_bulk_active_key(service_name), job.id, ex=BULK_STATE_TTL)
+        poll_job_id = schedule_bulk_poll(job.id)
+        progress.finish()
+        return {
+            'status': 'submitted',
+            'message': f'Submitted {cache_misses} items in {len(requests)} requests to the provider batch API; scores are applied when it finishes ({cache_hits} from cache, {prescored} pre-scored locally)',
+            'batch_ids': batch_ids,
+            'poll_job_id': poll_job_id,
+            'cache_hits': cache_hits,
+            'cache_misses': cache_misses,
+            'prescored': prescored
+        }
+
+    scored_batches = iter_scored_batches(ai_service, prepare_batches(), rules, concurrency)
+
+    # Batches complete in any order; each one is committed as soon as it arrives
+    stopped = False
+    for items_map, scores, error in scored_batches:
+        # Check Stop Flag
+        if redis_conn.exists(stop_flag):
+            stopped = True
+            break
+
+        if error is not None:
+            logger.error(f"Error scoring batch: {str(error)}")
+            # We continue to the next batch, but log the error
+            continue
+
+        scored = apply_scores(ModelClass, items_map, scores, rules_hash, scoring_model)
+        db.session.commit()
+        counts['processed'] += len(items_map)
         
-        logger.info(f"Processing batch of {len(batch_items)} items ({processed_count}/{total_items})")
+        # Update Progress (written to Redis by the reporter at a throttled rate)
+        percent = int((counts['processed'] / total_items) * 100)
         
-        # Prepare data
-        items_map = {}
-        items_data = []
+        # Calculate ETA
+        avg_time_per_item = (time.time() - start_time) / counts['processed']
+        remaining_items = total_items - counts['processed']
+        eta_seconds = int(remaining_items * avg_time_per_item)
         
-        for item in batch_items:
-            key = str(item.radarr_id) if service_name == 'Radarr' else str(item.sonarr_id)
-            items_map[key] = item
-            items_data.append({
-                'id': item.radarr_id if service_name == 'Radarr' else item.sonarr_id,
-                'title': item.title,
-                'year': item.year,
-                'overview': item.overview,
-                'labels': item.labels
-            })
-            
-        try:
-            batch_start = time.time()
-            logger.debug("Calling AI service to score items...")
-            scores = ai_service.score_items(items_data, service_settings.ai_rules)
-            
-            count = 0
-            for item_id, score in scores.items():
-                item_id_str = str(item_id)
-                if item_id_str in items_map:
-                    try:
-                        items_map[item_id_str].ai_score = int(score)
-                        count += 1
-                        logger.debug(f"Scored {items_map[item_id_str].title}: {score}")
-                    except (ValueError, TypeError):
-                        logger.warning(f"Invalid score value for item {item_id_str}: {score}")
-            
-            db.session.commit()
-            processed_count += len(batch_items)
-            
-            # Update Progress
-            progress = int((processed_count / total_items) * 100)
-            job.meta['progress'] = progress
-            
-            # Calculate ETA
-            batch_duration = time.time() - batch_start
-            if processed_count > 0:
-                avg_time_per_item = (time.time() - start_time) / processed_count
-                remaining_items = total_items - processed_count
-                eta_seconds = int(remaining_items * avg_time_per_item)
-            else:
-                eta_seconds = 0
-            
-            job.meta['status'] = f"Scoring... {progress}% (ETA: {eta_seconds}s)"
-            job.save_meta()
-            
-            logger.info(f"Batch complete. Scored {count}/{len(batch_items)}. Progress: {progress}%")
-            
-            # Sleep briefly to be nice to the API
-            time.sleep(1)
-            
-        except Exception as e:
-            logger.error(f"Error scoring batch: {str(e)}")
-            # We continue to the next batch, but log the error
-            # return {'error': f"Scoring failed at {processed_count}/{total_items}: {str(e)}"}
+        progress.update(done=counts['processed'], status=f"Scoring... {percent}% (ETA: {eta_seconds}s)", limiter=ai_service.limiter.snapshot())
+        
+        logger.info(f"Batch complete. Scored {scored}/{len(items_map)}. Progress: {percent}%")
+
+    cache_hits, cache_misses, prescored = counts['cache_hits'], counts['cache_misses'], counts['prescored']
+    processed_count = counts['processed']
+    logger.info(f"Score cache: {cache_hits} hits, {cache_misses} misses. Pre-scorer: {prescored} scored locally")
+
+    if stopped:
+        logger.info("Stop flag detected. Gracefully stopping task.")
+        redis_conn.delete(stop_flag)
+        return {'status': 'stopped', 'message': f'Scoring stopped by user at {processed_count}/{total_items}', 'cache_hits': cache_hits, 'cache_misses': cache_misses, 'prescored': prescored}
 
+    progress.finish()
     total_duration = int(time.time() - start_time)
-    logger.info(f"Scoring complete. Scored {total_items} items in {total_duration}s")
-    return {'status': 'success', 'message': f'Scored {total_items} items in {total_duration}s'}
+    limiter_stats = ai_service.limiter.snapshot()
+    # Kept after the job ends so batch sizes and limits can be tuned from /ai/limiter_stats
+    redis_conn.set(LIMITER_STATS_KEY, json.dumps(limiter_stats))
+    logger.info(f"Scoring complete. Scored {total_items} items in {total_duration}s. Limiter: {limiter_stats}")
+    return {
+        'status': 'success',
+        'message': f'Scored {total_items} items in {total_duration}s ({cache_hits} from cache, {prescored} pre-scored locally)',
+        'cache_hits': cache_hits,
+        'cache_misses': cache_misses,
+        'prescored': prescored,
+        'limiter': limiter_stats
+    }
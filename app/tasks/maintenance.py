@@ -3,11 +3,12 @@ from rq import get_current_job
 from flask import current_app
 from sqlalchemy import text
 from .. import db
+from .utils import ProgressReporter
 
 def vacuum_database():
     job = get_current_job()
-    job.meta['progress'] = 0
-    job.save_meta()
+    progress = ProgressReporter(job)
+    progress.flush()
 
     # This is a blocking operation, so we'll simulate progress
     # In a real scenario, you might break this down if possible,
@@ -15,8 +16,7 @@ def vacuum_database():
     
     # Simulate work starting
     time.sleep(1) 
-    job.meta['progress'] = 25
-    job.save_meta()
+    progress.flush(progress=25)
 
     with current_app.app_context():
         db.session.execute(text('VACUUM'))
@@ -24,12 +24,10 @@ def vacuum_database():
     
     # Simulate more work
     time.sleep(1)
-    job.meta['progress'] = 75
-    job.save_meta()
+    progress.flush(progress=75)
     
     # Finalize
     time.sleep(1)
-    job.meta['progress'] = 100
-    job.save_meta()
+    progress.finish()
     
     return {'status': 'Database vacuum completed'}
@@ -1,15 +1,21 @@
-import time
 from rq import get_current_job
 from .. import db
-from ..models import ServiceSettings, Movie
-from .utils import get_retry_session, fetch_tmdb_assets, update_service_tags
+from ..models import ServiceSettings, Movie, PosterCache
+from .ai import queue_incremental_rescore
+from .utils import (
+    get_retry_session, update_service_tags, bulk_upsert, content_fingerprint, cache_tag_map,
+    get_tmdb_settings, iter_tmdb_assets, load_poster_cache, is_recent_poster_miss, remove_orphaned_posters, get_http_stats,
+    iter_json_array, iter_batches, ProgressReporter, ASSET_BATCH_SIZE, SYNC_CHUNK_SIZE
+)
+
+# Columns mirrored from Radarr on every sync. Score and local state are never overwritten here.
+SYNCED_COLUMNS = ('tmdb_id', 'title', 'year', 'size_gb', 'overview', 'labels')
 
 def sync_radarr_movies(full_sync=False):
     job = get_current_job()
-    job.meta['progress'] = 0
-    job.save_meta()
-    start_time = time.time()
-    
+    progress = ProgressReporter(job)
+    progress.flush()
+
     redis_conn = job.connection
     redis_conn.delete('stop-job-flag')
 
@@ -23,86 +29,177 @@ def sync_radarr_movies(full_sync=False):
     # Fetch all tags to create a mapping from ID to Label and vice-versa
     tags_response = session.get(f"{settings.url}/api/v3/tag", headers=headers)
     tags_response.raise_for_status()
-    tag_map = {tag['id']: tag['label'] for tag in tags_response.json()}
-
-    response = session.get(f"{settings.url}/api/v3/movie", headers=headers)
-    response.raise_for_status()
-    movies_data = response.json()
-
+    tags_data = tags_response.json()
+    tag_map = {tag['id']: tag['label'] for tag in tags_data}
+    # Refresh the shared label -> id cache used by update_service_tags
+    cache_tag_map('Radarr', tags_data)
+
+    # Preload every known movie in a single query instead of one SELECT per item
+    existing = {
+        row.radarr_id: row
+        for row in db.session.query(
+            Movie.radarr_id, Movie.score, Movie.local_poster_path, Movie.content_hash, *[getattr(Movie, column) for column in SYNCED_COLUMNS]
+        )
+    }
+
+    # Needed up front: items are only queued for TMDB when a key is set and no recent miss is recorded
+    tmdb_api_key, tmdb_concurrency, tmdb_rate_limit = get_tmdb_settings()
+    poster_cache = load_poster_cache('movie')
+
+    inserted_count = 0
+    updated_count = 0
+    unchanged_count = 0
+    assets_to_fetch = []  # (radarr_id, tmdb_id, fingerprint) needing TMDB assets
     movies_to_update = {}  # Groups movies by tag changes required
 
-    total_movies = len(movies_data)
-    for i, movie_data in enumerate(movies_data):
-        if redis_conn.exists('stop-job-flag'):
-            break
-        movie = Movie.query.filter_by(radarr_id=movie_data['id']).first()
-        
-        # Bootstrap score for new movies from existing tags
-        if not movie:
-            movie = Movie(radarr_id=movie_data['id'])
-            current_labels = {tag_map.get(tag_id, '').lower() for tag_id in movie_data.get('tags', [])}
-            if 'ai-keep' in current_labels:
-                movie.score = 'Keep'
-            elif 'ai-delete' in current_labels:
-                movie.score = 'Delete'
-            elif 'ai-tautulli-keep' in current_labels:
-                movie.score = 'Tautulli Keep'
-            else:
-                movie.score = 'Not Scored'
-        
-        movie.tmdb_id = movie_data.get('tmdbId')
-        movie.title = movie_data.get('title')
-        movie.year = movie_data.get('year')
-        movie.size_gb = movie_data.get('sizeOnDisk', 0) / (1024**3)
-        movie.overview = movie_data.get('overview')
-        tag_ids = movie_data.get('tags', [])
-        movie.labels = ",".join([tag_map.get(tag_id) for tag_id in tag_ids if tag_id in tag_map])
-
-        # Sync tags based on score
-        current_labels = {tag_map.get(tag_id, '').lower() for tag_id in tag_ids}
-        tags_to_add_labels = set()
-        tags_to_remove_labels = set()
-
-        if movie.score == 'Keep':
-            tags_to_add_labels.add('ai-keep')
-            tags_to_remove_labels.update(['ai-delete', 'ai-tautulli-keep'])
-        elif movie.score == 'Delete':
-            tags_to_add_labels.add('ai-delete')
-            tags_to_remove_labels.update(['ai-keep', 'ai-tautulli-keep'])
-        elif movie.score == 'Tautulli Keep':
-            tags_to_add_labels.add('ai-tautulli-keep')
-            tags_to_remove_labels.update(['ai-keep', 'ai-delete'])
-        elif movie.score == 'Not Scored':
-            tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-tautulli-keep', 'ai-rolling-keep'])
-        
-        final_tags_to_add = tuple(sorted([tag for tag in tags_to_add_labels if tag not in current_labels]))
-        final_tags_to_remove = tuple(sorted([tag for tag in tags_to_remove_labels if tag in current_labels]))
-
-        if final_tags_to_add or final_tags_to_remove:
-            change_key = (final_tags_to_add, final_tags_to_remove)
-            if change_key not in movies_to_update:
-                movies_to_update[change_key] = []
-            movies_to_update[change_key].append(movie.radarr_id)
-
-        if (full_sync or not movie.local_poster_path) and movie.tmdb_id:
-            assets = fetch_tmdb_assets(movie.tmdb_id, 'movie')
-            if assets and isinstance(assets, tuple):
-                movie.local_poster_path = assets[0]
-
-        db.session.add(movie)
-
-        # ETA calculation
-        elapsed_time = time.time() - start_time
-        progress = (i + 1) / total_movies
-        if progress > 0:
-            eta_seconds = (elapsed_time / progress) * (1 - progress)
-            job.meta['eta'] = time.strftime("%M:%S", time.gmtime(eta_seconds))
-        
-        job.meta['progress'] = int(progress * 100)
-        job.save_meta()
-
+    # The previous library size is the best progress estimate available while streaming
+    progress.start(max(len(existing), 1))
+    total_movies = 0
+
+    # Stream the library instead of materializing the whole response; items are parsed
+    # incrementally and processed in fixed-size chunks so memory stays bounded. The with
+    # block releases the connection however the loop ends (stop flag, error, or the parser
+    # returning at the closing bracket without reading the rest of the body)
+    with session.get(f"{settings.url}/api/v3/movie", headers=headers, stream=True) as response:
+        response.raise_for_status()
+        movies_stream = iter_json_array(response)
+        for batch in iter_batches(movies_stream, SYNC_CHUNK_SIZE):
+            if redis_conn.exists('stop-job-flag'):
+                break
+            new_rows = []
+            changed_rows = []
+            for movie_data in batch:
+                radarr_id = movie_data['id']
+                tag_ids = movie_data.get('tags', [])
+                current_labels = {tag_map.get(tag_id, '').lower() for tag_id in tag_ids}
+
+                row = {
+                    'radarr_id': radarr_id,
+                    'tmdb_id': movie_data.get('tmdbId'),
+                    'title': movie_data.get('title'),
+                    'year': movie_data.get('year'),
+                    'size_gb': movie_data.get('sizeOnDisk', 0) / (1024**3),
+                    'overview': movie_data.get('overview'),
+                    'labels': ",".join([tag_map.get(tag_id) for tag_id in tag_ids if tag_id in tag_map]),
+                }
+
+                movie = existing.get(radarr_id)
+                score = movie.score if movie else None
+                fingerprint = content_fingerprint(row, score)
+
+                # Quick syncs skip items whose Radarr data and score are identical to the last sync
+                if movie is not None and not full_sync and movie.content_hash == fingerprint:
+                    unchanged_count += 1
+                else:
+                    if movie is None:
+                        # Bootstrap score for new movies from existing tags
+                        if 'ai-keep' in current_labels:
+                            score = 'Keep'
+                        elif 'ai-delete' in current_labels:
+                            score = 'Delete'
+                        elif 'ai-tautulli-keep' in current_labels:
+                            score = 'Tautulli Keep'
+                        else:
+                            score = 'Not Scored'
+                        fingerprint = content_fingerprint(row, score)
+                        row['score'] = score
+                        local_poster_path = None
+                    else:
+                        local_poster_path = movie.local_poster_path
+
+                    # Sync tags based on score
+                    tags_to_add_labels = set()
+                    tags_to_remove_labels = set()
+
+                    if score == 'Keep':
+                        tags_to_add_labels.add('ai-keep')
+                        tags_to_remove_labels.update(['ai-delete', 'ai-tautulli-keep'])
+                    elif score == 'Delete':
+                        tags_to_add_labels.add('ai-delete')
+                        tags_to_remove_labels.update(['ai-keep', 'ai-tautulli-keep'])
+                    elif score == 'Tautulli Keep':
+                        tags_to_add_labels.add('ai-tautulli-keep')
+                        tags_to_remove_labels.update(['ai-keep', 'ai-delete'])
+                    elif score == 'Not Scored':
+                        tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-tautulli-keep', 'ai-rolling-keep'])
+
+                    final_tags_to_add = tuple(sorted([tag for tag in tags_to_add_labels if tag not in current_labels]))
+                    final_tags_to_remove = tuple(sorted([tag for tag in tags_to_remove_labels if tag in current_labels]))
+
+                    # The fingerprint is only stored once nothing is pending for the item, so a failed
+                    # tag update or poster fetch is retried by the next quick sync.
+                    row['content_hash'] = fingerprint
+                    if final_tags_to_add or final_tags_to_remove:
+                        change_key = (final_tags_to_add, final_tags_to_remove)
+                        if change_key not in movies_to_update:
+                            movies_to_update[change_key] = []
+                        movies_to_update[change_key].append(radarr_id)
+                        row['content_hash'] = None
+
+                    # Posterless items are looked up again only once TMDB's last "no poster" answer is due for
+                    # revalidation. Without a TMDB key nothing is fetched, so the fingerprint is kept.
+                    needs_assets = full_sync or (not local_poster_path and not is_recent_poster_miss(poster_cache, f"movie_{row['tmdb_id']}"))
+                    if tmdb_api_key and needs_assets and row['tmdb_id']:
+                        assets_to_fetch.append((radarr_id, row['tmdb_id'], row['content_hash']))
+                        row['content_hash'] = None
+
+                    if movie is None:
+                        new_rows.append(row)
+                    elif movie.content_hash != row['content_hash'] or any(getattr(movie, column) != row[column] for column in SYNCED_COLUMNS):
+                        changed_rows.append(row)
+                    else:
+                        unchanged_count += 1
+
+            # New rows carry a bootstrapped score; existing rows only get their synced columns rewritten
+            inserted_count += bulk_upsert(Movie, 'radarr_id', new_rows)
+            updated_count += bulk_upsert(Movie, 'radarr_id', changed_rows)
+            db.session.commit()
+            total_movies += len(batch)
+            progress.update(done=total_movies)
+
+    # Posters are fetched in a separate, concurrent stage once the rows exist.
+    # Worker threads only talk to TMDB; results are written here in batches.
+    fingerprints = {radarr_id: fingerprint for radarr_id, _, fingerprint in assets_to_fetch}
+    asset_requests = [(radarr_id, tmdb_id, 'movie', None) for radarr_id, tmdb_id, _ in assets_to_fetch]
+    asset_rows = []
+    miss_rows = []
+    cache_rows = []
+    assets_fetched = 0
+    if tmdb_api_key and asset_requests:
+        progress.start(len(asset_requests))
+        for radarr_id, assets in iter_tmdb_assets(asset_requests, tmdb_api_key, tmdb_concurrency, tmdb_rate_limit, poster_cache):
+            if redis_conn.exists('stop-job-flag'):
+                break
+            if assets and assets['local_poster_path']:
+                asset_rows.append({
+                    'radarr_id': radarr_id,
+                    'local_poster_path': assets['local_poster_path'],
+                    'overview': assets['overview'],
+                    'cast': assets['cast'],
+                    'content_hash': fingerprints[radarr_id]
+                })
+                cache_rows.append(assets['poster_cache'])
+            elif assets:
+                # TMDB has no poster for it: record the miss and store the fingerprint
+                miss_rows.append({'radarr_id': radarr_id, 'content_hash': fingerprints[radarr_id]})
+                cache_rows.append(assets['poster_cache'])
+            if len(asset_rows) + len(miss_rows) >= ASSET_BATCH_SIZE:
+                assets_fetched += bulk_upsert(Movie, 'radarr_id', asset_rows)
+                bulk_upsert(Movie, 'radarr_id', miss_rows)
+                bulk_upsert(PosterCache, 'key', cache_rows)
+                db.session.commit()
+                asset_rows = []
+                miss_rows = []
+                cache_rows = []
+            progress.update()
+    assets_fetched += bulk_upsert(Movie, 'radarr_id', asset_rows)
+    bulk_upsert(Movie, 'radarr_id', miss_rows)
+    bulk_upsert(PosterCache, 'key', cache_rows)
     db.session.commit()
 
+    # Replaced and adopted poster files that no cache row or item references any more are removed on full syncs
+    posters_removed = remove_orphaned_posters() if full_sync else 0
+
     # After loop, apply tag changes in batches
     for (tags_to_add, tags_to_remove), movie_ids in movies_to_update.items():
         payload = {
@@ -112,4 +209,17 @@ def sync_radarr_movies(full_sync=False):
         }
         update_service_tags('Radarr', payload)
 
-    return {'status': 'Completed', 'movies_synced': total_movies}
+    progress.finish()
+    # Score items added by this sync (and anything left stale by rule changes) if enabled
+    rescore_job_id = queue_incremental_rescore('Radarr')
+    return {
+        'status': 'Completed',
+        'movies_synced': total_movies,
+        'inserted': inserted_count,
+        'updated': updated_count,
+        'unchanged': unchanged_count,
+        'assets_fetched': assets_fetched,
+        'posters_removed': posters_removed,
+        'http': get_http_stats(),
+        'rescore_job_id': rescore_job_id
+    }
@@ -0,0 +1,114 @@
+import json
+import random
+from collections import defaultdict, deque
+from datetime import datetime
+from .utils import bulk_update, chunked, SQL_IN_CHUNK_SIZE
+from ..prescorer import APP_TAG_PREFIX
+
+# Score classes the learning task samples from
+SAMPLE_CLASSES = {
+    'keep': ('Keep', 'Tautulli Keep'),
+    'delete': ('Delete',),
+}
+# Precomputed strata are rebuilt from the database after this long, so new Keep/Delete marks are picked up
+STRATA_CACHE_TTL = 3600
+# Upper bounds (GB) of the size buckets used as a stratum dimension
+SIZE_BUCKETS = ((2, 'S'), (10, 'M'), (30, 'L'))
+
+def _strata_key(service_name, sample_class):
+    return f"learn-strata:{service_name}:{sample_class}"
+
+def stratum_of(year, labels, size_gb):
+    """
+    Stratum name for an item: release decade, first label (alphabetically) and size bucket.
+    The app's own ai-* tags are skipped; every labelled item carries one.
+    """
+    decade = f"{year // 10 * 10}s" if year else 'unknown'
+    candidates = (label.strip().lower() for label in (labels or '').split(','))
+    label = min((label for label in candidates if label and not label.startswith(APP_TAG_PREFIX)), default='none')
+    size = next((name for limit, name in SIZE_BUCKETS if (size_gb or 0) < limit), 'XL')
+    return f"{decade}|{label}|{size}"
+
+def build_strata(ModelClass, scores):
+    """
+    Groups the ids of every item with one of `scores` by stratum, each list ordered from
+    least to most recently shown to the learning model. Reads only the indexed score
+    column and four small fields; no ORDER BY RANDOM() sort over the table.
+    """
+    strata = defaultdict(list)
+    rows = ModelClass.query.with_entities(
+        ModelClass.id, ModelClass.year, ModelClass.labels, ModelClass.size_gb, ModelClass.last_learned_at
+    ).filter(ModelClass.score.in_(scores))
+    for row in rows:
+        shown = row.last_learned_at.timestamp() if row.last_learned_at else 0
+        strata[stratum_of(row.year, row.labels, row.size_gb)].append([row.id, shown])
+    for entries in strata.values():
+        # Never-shown items first, in random order; then the longest-unseen ones
+        random.shuffle(entries)
+        entries.sort(key=lambda entry: entry[1])
+    return strata
+
+def load_strata(redis_conn, service_name, sample_class, ModelClass):
+    key = _strata_key(service_name, sample_class)
+    cached = redis_conn.hgetall(key)
+    if cached:
+        return {name.decode(): json.loads(entries) for name, entries in cached.items()}
+
+    strata = build_strata(ModelClass, SAMPLE_CLASSES[sample_class])
+    save_strata(redis_conn, service_name, sample_class, strata)
+    return strata
+
+def save_strata(redis_conn, service_name, sample_class, strata):
+    key = _strata_key(service_name, sample_class)
+    pipe = redis_conn.pipeline()
+    pipe.delete(key)
+    if strata:
+        pipe.hset(key, mapping={name: json.dumps(entries) for name, entries in strata.items()})
+        pipe.expire(key, STRATA_CACHE_TTL)
+    pipe.execute()
+
+def draw_stratified(strata, count):
+    """
+    Round-robin draw of up to `count` ids across strata, starting with the strata whose
+    next item has waited longest. Every stratum contributes before any gives a second item,
+    so rare decades, labels and sizes are represented. Drawn ids are removed from `strata`.
+    """
+    queues = {name: deque(entries) for name, entries in strata.items() if entries}
+    order = sorted(queues, key=lambda name: (queues[name][0][1], random.random()))
+    drawn = []
+    while order and len(drawn) < count:
+        for name in order:
+            drawn.append(queues[name].popleft()[0])
+            if len(drawn) >= count:
+                break
+        order = [name for name in order if queues[name]]
+    for name, entries in queues.items():
+        strata[name] = list(entries)
+    return drawn
+
+def sample_for_learning(redis_conn, service_name, ModelClass, sample_class, count):
+    """
+    Returns up to `count` items of a score class for the learning prompt, stratified by
+    decade, label and size and preferring items the model has not seen yet (or has seen
+    longest ago). The chosen items are stamped with last_learned_at and moved to the back
+    of their stratum, so successive runs (and successive calls in one run) cover new ground.
+    The caller is responsible for committing.
+    """
+    strata = load_strata(redis_conn, service_name, sample_class, ModelClass)
+    ids = draw_stratified(strata, count)
+    if not ids:
+        return []
+
+    # Ids come from a cache up to STRATA_CACHE_TTL old; re-check the class so stale entries drop out
+    items = []
+    for chunk in chunked(ids, SQL_IN_CHUNK_SIZE):
+        items.extend(ModelClass.query.filter(ModelClass.id.in_(chunk), ModelClass.score.in_(SAMPLE_CLASSES[sample_class])).all())
+
+    # Put the drawn ids back at the end of their strata with the new timestamp
+    now = datetime.now()
+    for item in items:
+        strata.setdefault(stratum_of(item.year, item.labels, item.size_gb), []).append([item.id, now.timestamp()])
+    save_strata(redis_conn, service_name, sample_class, strata)
+
+    bulk_update(ModelClass, [{'id': item.id, 'last_learned_at': now} for item in items])
+    return items
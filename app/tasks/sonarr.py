@@ -1,14 +1,20 @@
-import time
 from rq import get_current_job
 from .. import db
-from ..models import ServiceSettings, Show
-from .utils import get_retry_session, fetch_tmdb_assets, update_service_tags
+from ..models import ServiceSettings, Show, PosterCache
+from .ai import queue_incremental_rescore
+from .utils import (
+    get_retry_session, update_service_tags, bulk_upsert, content_fingerprint, cache_tag_map,
+    get_tmdb_settings, iter_tmdb_assets, load_poster_cache, is_recent_poster_miss, remove_orphaned_posters, get_http_stats,
+    iter_json_array, iter_batches, ProgressReporter, ASSET_BATCH_SIZE, SYNC_CHUNK_SIZE
+)
+
+# Columns mirrored from Sonarr on every sync. Score and local state are never overwritten here.
+SYNCED_COLUMNS = ('tvdb_id', 'title', 'year', 'size_gb', 'overview', 'labels')
 
 def sync_sonarr_shows(full_sync=False):
     job = get_current_job()
-    job.meta['progress'] = 0
-    job.save_meta()
-    start_time = time.time()
+    progress = ProgressReporter(job)
+    progress.flush()
 
     redis_conn = job.connection
     redis_conn.delete('stop-job-flag')
@@ -23,94 +29,193 @@ def sync_sonarr_shows(full_sync=False):
     # Fetch all tags to create a mapping from ID to Label
     tags_response = session.get(f"{settings.url}/api/v3/tag", headers=headers)
     tags_response.raise_for_status()
-    tag_map = {tag['id']: tag['label'] for tag in tags_response.json()}
+    tags_data = tags_response.json()
+    tag_map = {tag['id']: tag['label'] for tag in tags_data}
+    # Refresh the shared label -> id cache used by update_service_tags
+    cache_tag_map('Sonarr', tags_data)
+
+    # Preload every known show in a single query instead of one SELECT per item
+    existing = {
+        row.sonarr_id: row
+        for row in db.session.query(
+            Show.sonarr_id, Show.score, Show.local_poster_path, Show.content_hash, Show.tmdb_id, *[getattr(Show, column) for column in SYNCED_COLUMNS]
+        )
+    }
 
-    response = session.get(f"{settings.url}/api/v3/series", headers=headers)
-    response.raise_for_status()
-    shows_data = response.json()
+    # Needed up front: items are only queued for TMDB when a key is set and no recent miss is recorded
+    tmdb_api_key, tmdb_concurrency, tmdb_rate_limit = get_tmdb_settings()
+    poster_cache = load_poster_cache('tv')
 
+    inserted_count = 0
+    updated_count = 0
+    unchanged_count = 0
+    assets_to_fetch = []  # (sonarr_id, tvdb_id, fingerprint) needing TMDB assets
     shows_to_update = {}  # Groups shows by tag changes required
 
-    total_shows = len(shows_data)
-    for i, show_data in enumerate(shows_data):
-        if redis_conn.exists('stop-job-flag'):
-            break
-        show = Show.query.filter_by(sonarr_id=show_data['id']).first()
-        
-        # Bootstrap score for new shows from existing tags
-        if not show:
-            show = Show(sonarr_id=show_data['id'])
-            current_labels = {tag_map.get(tag_id, '').lower() for tag_id in show_data.get('tags', [])}
-            if 'ai-keep' in current_labels:
-                show.score = 'Keep'
-            elif 'ai-delete' in current_labels:
-                show.score = 'Delete'
-            elif 'ai-rolling-keep' in current_labels:
-                show.score = 'Seasonal'
-            elif 'ai-tautulli-keep' in current_labels:
-                show.score = 'Tautulli Keep'
-            else:
-                show.score = 'Not Scored'
-
-        show.tvdb_id = show_data.get('tvdbId')
-        show.title = show_data.get('title')
-        show.year = show_data.get('year')
-        if 'statistics' in show_data:
-            show.size_gb = show_data['statistics'].get('sizeOnDisk', 0) / (1024**3)
-        show.overview = show_data.get('overview')
-        tag_ids = show_data.get('tags', [])
-        show.labels = ",".join([tag_map.get(tag_id) for tag_id in tag_ids if tag_id in tag_map])
-
-        # Sync tags based on score
-        current_labels = {tag_map.get(tag_id, '').lower() for tag_id in tag_ids}
-        tags_to_add_labels = set()
-        tags_to_remove_labels = set()
-
-        if show.score == 'Keep':
-            tags_to_add_labels.add('ai-keep')
-            tags_to_remove_labels.update(['ai-delete', 'ai-rolling-keep', 'ai-tautulli-keep'])
-        elif show.score == 'Delete':
-            tags_to_add_labels.add('ai-delete')
-            tags_to_remove_labels.update(['ai-keep', 'ai-rolling-keep', 'ai-tautulli-keep'])
-        elif show.score == 'Seasonal':
-            tags_to_add_labels.add('ai-rolling-keep')
-            tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-tautulli-keep'])
-        elif show.score == 'Tautulli Keep':
-            tags_to_add_labels.add('ai-tautulli-keep')
-            tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-rolling-keep'])
-        elif show.score == 'Not Scored':
-            tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-rolling-keep', 'ai-tautulli-keep'])
-
-        final_tags_to_add = tuple(sorted([tag for tag in tags_to_add_labels if tag not in current_labels]))
-        final_tags_to_remove = tuple(sorted([tag for tag in tags_to_remove_labels if tag in current_labels]))
-
-        if final_tags_to_add or final_tags_to_remove:
-            change_key = (final_tags_to_add, final_tags_to_remove)
-            if change_key not in shows_to_update:
-                shows_to_update[change_key] = []
-            shows_to_update[change_key].append(show.sonarr_id)
-        
-        if (full_sync or not show.local_poster_path) and show.tvdb_id:
-            assets = fetch_tmdb_assets(show.tvdb_id, 'tv')
-            if assets and isinstance(assets, tuple):
-                show.local_poster_path = assets[0]
-                if assets[1]:
-                    show.tmdb_id = assets[1]
-        
-        db.session.add(show)
-        
-        # ETA calculation
-        elapsed_time = time.time() - start_time
-        progress = (i + 1) / total_shows
-        if progress > 0:
-            eta_seconds = (elapsed_time / progress) * (1 - progress)
-            job.meta['eta'] = time.strftime("%M:%S", time.gmtime(eta_seconds))
-
-        job.meta['progress'] = int(progress * 100)
-        job.save_meta()
-        
+    # The previous library size is the best progress estimate available while streaming
+    progress.start(max(len(existing), 1))
+    total_shows = 0
+
+    # Stream the library instead of materializing the whole response; items are parsed
+    # incrementally and processed in fixed-size chunks so memory stays bounded. The with
+    # block releases the connection however the loop ends (stop flag, error, or the parser
+    # returning at the closing bracket without reading the rest of the body)
+    with session.get(f"{settings.url}/api/v3/series", headers=headers, stream=True) as response:
+        response.raise_for_status()
+        shows_stream = iter_json_array(response)
+        for batch in iter_batches(shows_stream, SYNC_CHUNK_SIZE):
+            if redis_conn.exists('stop-job-flag'):
+                break
+            new_rows = []
+            changed_rows = []
+            for show_data in batch:
+                sonarr_id = show_data['id']
+                show = existing.get(sonarr_id)
+                tag_ids = show_data.get('tags', [])
+                current_labels = {tag_map.get(tag_id, '').lower() for tag_id in tag_ids}
+
+                if 'statistics' in show_data:
+                    size_gb = show_data['statistics'].get('sizeOnDisk', 0) / (1024**3)
+                else:
+                    size_gb = show.size_gb if show else None
+
+                row = {
+                    'sonarr_id': sonarr_id,
+                    'tvdb_id': show_data.get('tvdbId'),
+                    'title': show_data.get('title'),
+                    'year': show_data.get('year'),
+                    'size_gb': size_gb,
+                    'overview': show_data.get('overview'),
+                    'labels': ",".join([tag_map.get(tag_id) for tag_id in tag_ids if tag_id in tag_map]),
+                }
+
+                score = show.score if show else None
+                fingerprint = content_fingerprint(row, score)
+
+                # Quick syncs skip items whose Sonarr data and score are identical to the last sync
+                if show is not None and not full_sync and show.content_hash == fingerprint:
+                    unchanged_count += 1
+                else:
+                    if show is None:
+                        # Bootstrap score for new shows from existing tags
+                        if 'ai-keep' in current_labels:
+                            score = 'Keep'
+                        elif 'ai-delete' in current_labels:
+                            score = 'Delete'
+                        elif 'ai-rolling-keep' in current_labels:
+                            score = 'Seasonal'
+                        elif 'ai-tautulli-keep' in current_labels:
+                            score = 'Tautulli Keep'
+                        else:
+                            score = 'Not Scored'
+                        fingerprint = content_fingerprint(row, score)
+                        row['score'] = score
+                        local_poster_path = None
+                    else:
+                        local_poster_path = show.local_poster_path
+
+                    # Sync tags based on score
+                    tags_to_add_labels = set()
+                    tags_to_remove_labels = set()
+
+                    if score == 'Keep':
+                        tags_to_add_labels.add('ai-keep')
+                        tags_to_remove_labels.update(['ai-delete', 'ai-rolling-keep', 'ai-tautulli-keep'])
+                    elif score == 'Delete':
+                        tags_to_add_labels.add('ai-delete')
+                        tags_to_remove_labels.update(['ai-keep', 'ai-rolling-keep', 'ai-tautulli-keep'])
+                    elif score == 'Seasonal':
+                        tags_to_add_labels.add('ai-rolling-keep')
+                        tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-tautulli-keep'])
+                    elif score == 'Tautulli Keep':
+                        tags_to_add_labels.add('ai-tautulli-keep')
+                        tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-rolling-keep'])
+                    elif score == 'Not Scored':
+                        tags_to_remove_labels.update(['ai-keep', 'ai-delete', 'ai-rolling-keep', 'ai-tautulli-keep'])
+
+                    final_tags_to_add = tuple(sorted([tag for tag in tags_to_add_labels if tag not in current_labels]))
+                    final_tags_to_remove = tuple(sorted([tag for tag in tags_to_remove_labels if tag in current_labels]))
+
+                    # The fingerprint is only stored once nothing is pending for the item, so a failed
+                    # tag update or poster fetch is retried by the next quick sync.
+                    row['content_hash'] = fingerprint
+                    if final_tags_to_add or final_tags_to_remove:
+                        change_key = (final_tags_to_add, final_tags_to_remove)
+                        if change_key not in shows_to_update:
+                            shows_to_update[change_key] = []
+                        shows_to_update[change_key].append(sonarr_id)
+                        row['content_hash'] = None
+
+                    # Posterless items are looked up again only once TMDB's last "no poster" answer is due for
+                    # revalidation. Without a TMDB key nothing is fetched, so the fingerprint is kept.
+                    poster_key = f"tv_{show.tmdb_id}" if show is not None and show.tmdb_id else f"tv_tvdb_{row['tvdb_id']}"
+                    needs_assets = full_sync or (not local_poster_path and not is_recent_poster_miss(poster_cache, poster_key))
+                    if tmdb_api_key and needs_assets and row['tvdb_id']:
+                        assets_to_fetch.append((sonarr_id, row['tvdb_id'], row['content_hash']))
+                        row['content_hash'] = None
+
+                    if show is None:
+                        new_rows.append(row)
+                    elif show.content_hash != row['content_hash'] or any(getattr(show, column) != row[column] for column in SYNCED_COLUMNS):
+                        changed_rows.append(row)
+                    else:
+                        unchanged_count += 1
+
+            # New rows carry a bootstrapped score; existing rows only get their synced columns rewritten
+            inserted_count += bulk_upsert(Show, 'sonarr_id', new_rows)
+            updated_count += bulk_upsert(Show, 'sonarr_id', changed_rows)
+            db.session.commit()
+            total_shows += len(batch)
+            progress.update(done=total_shows)
+
+    # Posters are fetched in a separate, concurrent stage once the rows exist.
+    # Worker threads only talk to TMDB; results are written here in batches.
+    fingerprints = {sonarr_id: fingerprint for sonarr_id, _, fingerprint in assets_to_fetch}
+    # A known TMDB id lets the fetcher skip the TVDB -> TMDB find call
+    asset_requests = [
+        (sonarr_id, tvdb_id, 'tv', existing[sonarr_id].tmdb_id if sonarr_id in existing else None)
+        for sonarr_id, tvdb_id, _ in assets_to_fetch
+    ]
+    asset_rows = []
+    miss_rows = []
+    cache_rows = []
+    assets_fetched = 0
+    if tmdb_api_key and asset_requests:
+        progress.start(len(asset_requests))
+        for sonarr_id, assets in iter_tmdb_assets(asset_requests, tmdb_api_key, tmdb_concurrency, tmdb_rate_limit, poster_cache):
+            if redis_conn.exists('stop-job-flag'):
+                break
+            if assets and assets['local_poster_path']:
+                asset_rows.append({
+                    'sonarr_id': sonarr_id,
+                    'local_poster_path': assets['local_poster_path'],
+                    'tmdb_id': assets['tmdb_id'],
+                    'overview': assets['overview'],
+                    'cast': assets['cast'],
+                    'content_hash': fingerprints[sonarr_id]
+                })
+                cache_rows.append(assets['poster_cache'])
+            elif assets:
+                # TMDB has no poster for it: record the miss and store the fingerprint
+                miss_rows.append({'sonarr_id': sonarr_id, 'tmdb_id': assets['tmdb_id'], 'content_hash': fingerprints[sonarr_id]})
+                cache_rows.append(assets['poster_cache'])
+            if len(asset_rows) + len(miss_rows) >= ASSET_BATCH_SIZE:
+                assets_fetched += bulk_upsert(Show, 'sonarr_id', asset_rows)
+                bulk_upsert(Show, 'sonarr_id', miss_rows)
+                bulk_upsert(PosterCache, 'key', cache_rows)
+                db.session.commit()
+                asset_rows = []
+                miss_rows = []
+                cache_rows = []
+            progress.update()
+    assets_fetched += bulk_upsert(Show, 'sonarr_id', asset_rows)
+    bulk_upsert(Show, 'sonarr_id', miss_rows)
+    bulk_upsert(PosterCache, 'key', cache_rows)
     db.session.commit()
-        
+
+    # Replaced and adopted poster files that no cache row or item references any more are removed on full syncs
+    posters_removed = remove_orphaned_posters() if full_sync else 0
+
     # After loop, apply tag changes in batches
     for (tags_to_add, tags_to_remove), series_ids in shows_to_update.items():
         payload = {
@@ -120,4 +225,17 @@ def sync_sonarr_shows(full_sync=False):
         }
         update_service_tags('Sonarr', payload)
 
-    return {'status': 'Completed', 'shows_synced': total_shows}
+    progress.finish()
+    # Score items added by this sync (and anything left stale by rule changes) if enabled
+    rescore_job_id = queue_incremental_rescore('Sonarr')
+    return {
+        'status': 'Completed',
+        'shows_synced': total_shows,
+        'inserted': inserted_count,
+        'updated': updated_count,
+        'unchanged': unchanged_count,
+        'assets_fetched': assets_fetched,
+        'posters_removed': posters_removed,
+        'http': get_http_stats(),
+        'rescore_job_id': rescore_job_id
+    }
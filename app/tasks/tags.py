@@ -0,0 +1,77 @@
+import json
+import time
+from datetime import datetime
+from flask import current_app
+from rq import get_current_job
+from .utils import update_service_tags
+
+# Changes arriving within this many seconds of each other are sent as one editor call
+TAG_COALESCE_WINDOW = 2
+# Safety expiry of the "flush scheduled" flag. The flush job clears it itself within seconds
+# on the dedicated tag worker; the expiry only matters if that job dies before getting there.
+TAG_FLUSH_LOCK_TTL = 300
+
+ID_KEYS = {'Radarr': 'movieIds', 'Sonarr': 'seriesIds'}
+
+def _pending_key(service_name):
+    return f"tag-pending:{service_name}"
+
+def _scheduled_key(service_name):
+    return f"tag-flush-scheduled:{service_name}"
+
+def queue_tag_update(service_name, payload):
+    """
+    Records a tag change for background propagation and returns immediately.
+
+    Pending changes live in a Redis hash keyed by item id. Every action carries the
+    complete set of ai-* tags to add and remove, so a later click on the same item
+    simply replaces the earlier one. At most one flush job per service is queued at a time.
+    """
+    id_key = ID_KEYS.get(service_name)
+    if not id_key or not payload.get(id_key):
+        return
+    if not payload.get('tagsToAdd') and not payload.get('tagsToRemove'):
+        return
+
+    change = json.dumps([sorted(payload.get('tagsToAdd', [])), sorted(payload.get('tagsToRemove', []))])
+    redis_conn = current_app.queue.connection
+    redis_conn.hset(_pending_key(service_name), mapping={str(item_id): change for item_id in payload[id_key]})
+
+    if redis_conn.set(_scheduled_key(service_name), 1, nx=True, ex=TAG_FLUSH_LOCK_TTL):
+        current_app.tag_queue.enqueue(propagate_tag_changes, service_name, job_timeout='10m')
+
+def propagate_tag_changes(service_name):
+    job = get_current_job()
+    redis_conn = job.connection
+
+    # Give rapid-fire clicks a moment to accumulate before draining. The window counts from
+    # when the flush was queued, so a job that started late drains right away.
+    waited = (datetime.utcnow() - job.enqueued_at).total_seconds() if job.enqueued_at else 0
+    if waited < TAG_COALESCE_WINDOW:
+        time.sleep(TAG_COALESCE_WINDOW - waited)
+
+    # Clear the flag before draining so changes arriving from here on schedule a new flush
+    redis_conn.delete(_scheduled_key(service_name))
+    pipe = redis_conn.pipeline()
+    pipe.hgetall(_pending_key(service_name))
+    pipe.delete(_pending_key(service_name))
+    pending, _ = pipe.execute()
+
+    # Group items by their (add, remove) tuple so each distinct change is one editor call
+    groups = {}
+    for item_id, change in pending.items():
+        tags_to_add, tags_to_remove = json.loads(change)
+        groups.setdefault((tuple(tags_to_add), tuple(tags_to_remove)), []).append(int(item_id))
+
+    id_key = ID_KEYS[service_name]
+    for (tags_to_add, tags_to_remove), item_ids in groups.items():
+        result = update_service_tags(service_name, {
+            id_key: item_ids,
+            'tagsToAdd': list(tags_to_add),
+            'tagsToRemove': list(tags_to_remove)
+        })
+        if result.get('error'):
+            # The next sync reconciles tags for items whose score changed, so nothing is lost
+            print(f"Error propagating tags to {service_name}: {result['error']}")
+
+    return {'status': 'Completed', 'items': len(pending), 'groups': len(groups)}
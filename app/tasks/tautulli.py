@@ -1,14 +1,62 @@
 import time
 from datetime import datetime, timedelta
 from rq import get_current_job
+from sqlalchemy import and_, or_
 from .. import db
 from ..models import ServiceSettings, Movie, Show, TautulliHistory
-from .utils import get_retry_session, update_service_tags
+from .utils import get_retry_session, update_service_tags, bulk_upsert, chunked, ProgressReporter, SQL_IN_CHUNK_SIZE
+
+# Rows requested per get_history call
+HISTORY_PAGE_SIZE = 1000
+
+def _insert_history(items):
+    """Bulk-inserts history rows that are not stored yet. Returns the number inserted."""
+    row_ids = {item['id'] for item in items}
+    if not row_ids:
+        return 0
+    existing = {
+        row_id for (row_id,) in db.session.query(TautulliHistory.row_id).filter(TautulliHistory.row_id.in_(row_ids))
+    }
+    new_rows = {}
+    for item in items:
+        if item['id'] in existing or item['id'] in new_rows:
+            continue
+        new_rows[item['id']] = {
+            'row_id': item['id'],
+            'title': item['full_title'],
+            'user': item['user'],
+            'date': datetime.fromtimestamp(item['date']),
+            'state': item.get('state'),
+            'duration_mins': (item.get('duration_in_seconds') or 0) // 60
+        }
+    return bulk_upsert(TautulliHistory, 'row_id', list(new_rows.values()), ignore_existing=True)
+
+def reconcile_watched_titles(model, service_id_column, watched_titles, protected_scores):
+    """
+    Applies the watch history to one library with set-based UPDATEs.
+
+    Items whose title was watched become 'Tautulli Keep' unless their score is protected;
+    'Tautulli Keep' items no longer in the history fall back to 'Not Scored' (their tag is
+    removed by the next Radarr/Sonarr sync). Returns (rescued service ids, released count).
+    """
+    rescuable = or_(model.score.is_(None), model.score.notin_(protected_scores + ['Tautulli Keep']))
+    rescued = []
+    for titles in chunked(sorted(watched_titles), SQL_IN_CHUNK_SIZE):
+        condition = and_(model.title.in_(titles), rescuable)
+        rescued.extend(service_id for (service_id,) in db.session.query(service_id_column).filter(condition))
+        model.query.filter(condition).update({model.score: 'Tautulli Keep'}, synchronize_session=False)
+
+    kept = db.session.query(model.id, model.title).filter(model.score == 'Tautulli Keep').all()
+    released_ids = [item_id for item_id, title in kept if title not in watched_titles]
+    for item_ids in chunked(released_ids, SQL_IN_CHUNK_SIZE):
+        model.query.filter(model.id.in_(item_ids)).update({model.score: 'Not Scored'}, synchronize_session=False)
+
+    return rescued, len(released_ids)
 
 def sync_tautulli_history(full_sync=False):
     job = get_current_job()
-    job.meta['progress'] = 0
-    job.save_meta()
+    progress = ProgressReporter(job)
+    progress.flush()
     start_time = time.time()
 
     redis_conn = job.connection
@@ -17,100 +65,85 @@ def sync_tautulli_history(full_sync=False):
     settings = ServiceSettings.query.filter_by(service_name='Tautulli').first()
     if not settings:
         return {'error': 'Tautulli settings not found'}
-    
+
     session = get_retry_session()
-    
-    # Determine fetch length based on sync type
-    # Full sync: Fetch a large number (effectively all relevant history)
-    # Quick sync: Fetch last 1000 items
-    fetch_length = 100000 if full_sync else 1000
-    
+    retention_cutoff = datetime.now() - timedelta(days=settings.retention_days)
+
+    # Quick syncs only page back to the last fully synced row; full syncs walk the whole retention window
+    cursor = None if full_sync else settings.history_cursor
     params = {
         'cmd': 'get_history',
         'apikey': settings.api_key,
-        'length': fetch_length,
-        'after': (datetime.now() - timedelta(days=settings.retention_days)).strftime('%Y-%m-%d')
+        'length': HISTORY_PAGE_SIZE,
+        'order_column': 'date',
+        'order_dir': 'desc',
+        'after': retention_cutoff.strftime('%Y-%m-%d')
     }
-    response = session.get(f"{settings.url}/api/v2", params=params)
-    response.raise_for_status()
-    history_data = response.json()['response']['data']['data']
 
-    rescued_movies = []
-    rescued_shows = []
-    total_items = len(history_data)
+    fetched = 0
+    inserted = 0
+    highest_row_id = cursor
+    expected = None
+    completed = False
+    while True:
+        if redis_conn.exists('stop-job-flag'):
+            break
 
-    # Get all movie and show titles that have been watched recently
-    watched_titles = {item['full_title'] for item in history_data}
+        response = session.get(f"{settings.url}/api/v2", params=dict(params, start=fetched))
+        response.raise_for_status()
+        page_data = response.json()['response']['data']
+        page = page_data['data']
+        if expected is None:
+            expected = page_data.get('recordsFiltered') or len(page)
+            if cursor is not None:
+                # Only rows newer than the cursor are expected; estimate how many that is
+                known = TautulliHistory.query.filter(TautulliHistory.date >= retention_cutoff).count()
+                expected = max(1, expected - known)
+            progress.start(expected)
 
-    # Process all movies
-    all_movies = Movie.query.all()
-    for movie in all_movies:
-        if movie.score in ['Keep']:
-            continue
-        
-        if movie.title in watched_titles:
-            if movie.score != 'Tautulli Keep':
-                movie.score = 'Tautulli Keep'
-                rescued_movies.append(movie.radarr_id)
-        elif movie.score == 'Tautulli Keep':
-            movie.score = 'Not Scored'
-            # Tag removal will be handled by the next sync with Radarr
-
-    # Process all shows
-    all_shows = Show.query.all()
-    for show in all_shows:
-        if redis_conn.exists('stop-job-flag'):
+        new_items = [item for item in page if cursor is None or item['id'] > cursor]
+        inserted += _insert_history(new_items)
+        db.session.commit()
+        fetched += len(page)
+        if new_items:
+            highest_row_id = max([highest_row_id or 0] + [item['id'] for item in new_items])
+
+        progress.update(done=fetched)
+
+        # Stop at the cursor or at the last page
+        if len(new_items) < len(page) or len(page) < HISTORY_PAGE_SIZE:
+            completed = True
             break
-        if show.score in ['Keep', 'Seasonal']:
-            continue
 
-        if show.title in watched_titles:
-            if show.score != 'Tautulli Keep':
-                show.score = 'Tautulli Keep'
-                rescued_shows.append(show.sonarr_id)
-        elif show.score == 'Tautulli Keep':
-            show.score = 'Not Scored'
-            # Tag removal will be handled by the next sync with Sonarr
-
-    for i, item in enumerate(history_data):
-        history_entry = TautulliHistory.query.filter_by(row_id=item['id']).first()
-        if not history_entry:
-            history_entry = TautulliHistory(
-                row_id=item['id'],
-                title=item['full_title'],
-                user=item['user'],
-                date=datetime.fromtimestamp(item['date']),
-                state=item.get('state'),
-                duration_mins=item.get('duration_in_seconds', 0) // 60
-            )
-            db.session.add(history_entry)
-
-        # Rescue logic
-        movie_to_rescue = Movie.query.filter_by(title=item['full_title'], score='Delete').first()
-        if movie_to_rescue:
-            movie_to_rescue.score = 'Tautulli Keep'
-            rescued_movies.append(movie_to_rescue.radarr_id)
-        
-        show_to_rescue = Show.query.filter_by(title=item['full_title'], score='Delete').first()
-        if show_to_rescue:
-            show_to_rescue.score = 'Tautulli Keep'
-            rescued_shows.append(show_to_rescue.sonarr_id)
-        
-        # ETA calculation
-        elapsed_time = time.time() - start_time
-        progress = (i + 1) / total_items
-        if progress > 0:
-            eta_seconds = (elapsed_time / progress) * (1 - progress)
-            job.meta['eta'] = time.strftime("%M:%S", time.gmtime(eta_seconds))
-
-        job.meta['progress'] = int(progress * 100)
-        job.save_meta()
+    # The cursor only advances after an uninterrupted walk, so a stopped sync never leaves a gap
+    if completed and highest_row_id is not None:
+        settings.history_cursor = highest_row_id
+        db.session.commit()
+
+    # Watched titles come from the stored history, which now covers the whole retention window
+    watched_titles = {
+        title for (title,) in db.session.query(TautulliHistory.title).filter(TautulliHistory.date >= retention_cutoff).distinct()
+    }
 
+    rescued_movies, released_movies = reconcile_watched_titles(Movie, Movie.radarr_id, watched_titles, ['Keep'])
+    rescued_shows, released_shows = reconcile_watched_titles(Show, Show.sonarr_id, watched_titles, ['Keep', 'Seasonal'])
     db.session.commit()
 
+    progress.finish()
+
     if rescued_movies:
         update_service_tags('Radarr', {'movieIds': rescued_movies, 'tagsToAdd': ['ai-tautulli-keep'], 'tagsToRemove': ['ai-delete']})
     if rescued_shows:
         update_service_tags('Sonarr', {'seriesIds': rescued_shows, 'tagsToAdd': ['ai-tautulli-keep'], 'tagsToRemove': ['ai-delete']})
 
-    return {'status': 'Completed', 'history_synced': len(history_data), 'rescued_movies': len(rescued_movies), 'rescued_shows': len(rescued_shows)}
+    return {
+        'status': 'Completed',
+        'history_synced': fetched,
+        'history_inserted': inserted,
+        'cursor': settings.history_cursor,
+        'rescued_movies': len(rescued_movies),
+        'rescued_shows': len(rescued_shows),
+        'released_movies': released_movies,
+        'released_shows': released_shows,
+        'duration_seconds': int(time.time() - start_time)
+    }
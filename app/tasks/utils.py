@@ -1,100 +1,589 @@
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+import codecs
+import hashlib
+import itertools
+import json
+import re
 import os
+import threading
+import time
 from .. import db
-from ..models import ServiceSettings, Movie, Show
+from ..http_client import get_http_session, get_http_stats
+from ..job_events import publish_job_progress
+from ..models import ServiceSettings, Movie, Show, PosterCache
 
 def get_retry_session():
-    session = requests.Session()
-    retry = Retry(
-        total=5,
-        read=5,
-        connect=5,
-        backoff_factor=0.3,
-        status_forcelist=(500, 502, 503, 504, 429),
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+    # Kept for existing callers; every caller now shares the process-wide pooled session
+    return get_http_session()
 
-def fetch_tmdb_assets(media_id, media_type='movie'):
+# TMDB allows roughly 50 requests/second per IP; stay comfortably below it by default
+DEFAULT_TMDB_CONCURRENCY = 8
+DEFAULT_TMDB_RATE_LIMIT = 20
+# Cached posters are trusted for this long before being revalidated with a conditional GET
+POSTER_REVALIDATE_DAYS = 30
+# Poster files younger than this are never removed as orphans; their cache row may not be committed yet
+ORPHAN_POSTER_MIN_AGE_SECONDS = 3600
+# Asset results are written to the database in batches of this size
+ASSET_BATCH_SIZE = 200
+
+# Tag label -> id maps are shared between processes through Redis for this long
+TAG_CACHE_TTL = 3600
+TAG_CACHE_SENTINEL = '__loaded__'
+
+# Bytes read per network chunk when streaming large JSON responses
+STREAM_CHUNK_SIZE = 64 * 1024
+# Items parsed, diffed and written per step of a streamed library sync
+SYNC_CHUNK_SIZE = 500
+
+# Job progress is written to Redis at most once per this many items or milliseconds
+PROGRESS_FLUSH_ITEMS = 100
+PROGRESS_FLUSH_MS = 500
+
+# Rows per INSERT ... ON CONFLICT statement. Each chunk is sent as a single
+# executemany, so this only bounds memory and statement size, not round trips.
+UPSERT_CHUNK_SIZE = 500
+# Values per IN (...) clause, kept under SQLite's bound-parameter limit
+SQL_IN_CHUNK_SIZE = 500
+# Rows read per keyset page when walking a large table
+KEYSET_WINDOW_SIZE = 1000
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def bulk_upsert(model, key, rows, chunk_size=UPSERT_CHUNK_SIZE, ignore_existing=False):
+    """
+    Writes rows with SQLite INSERT ... ON CONFLICT(key) DO UPDATE.
+    All rows must share the same columns; every column except the key is
+    overwritten on conflict, or left untouched with ignore_existing=True.
+    The caller is responsible for committing.
+    """
+    if not rows:
+        return 0
+
+    table = model.__table__
+    columns = [column for column in rows[0] if column != key]
+    for chunk in chunked(rows, chunk_size):
+        stmt = sqlite_insert(table)
+        if columns and not ignore_existing:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[key],
+                set_={column: stmt.excluded[column] for column in columns}
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[key])
+        db.session.execute(stmt, chunk)
+    return len(rows)
+
+def bulk_update(model, rows, chunk_size=UPSERT_CHUNK_SIZE):
+    """
+    Writes rows (dicts holding the primary key and the columns to change) as ORM bulk
+    UPDATEs by primary key, one executemany per chunk, without loading any instances.
+    The caller is responsible for committing.
+    """
+    if not rows:
+        return 0
+
+    for chunk in chunked(rows, chunk_size):
+        db.session.execute(update(model), chunk)
+    return len(rows)
+
+def iter_keyset_windows(query, key, window_size=KEYSET_WINDOW_SIZE, limit=0):
+    """
+    Yields the rows of `query` in pages ordered by `key` (a unique column such as the
+    primary key), each page starting after the last key seen instead of at an OFFSET.
+    Rows updated or deleted between pages never shift the walk. Stops after `limit`
+    rows when set. Query column tuples (with_entities) so pages are not kept in the session.
+    """
+    last_key = None
+    remaining = limit or None
+    while True:
+        size = min(window_size, remaining) if remaining else window_size
+        page = query if last_key is None else query.filter(key > last_key)
+        rows = page.order_by(key).limit(size).all()
+        if not rows:
+            return
+        yield rows
+        if remaining:
+            remaining -= len(rows)
+            if remaining <= 0:
+                return
+        if len(rows) < size:
+            return
+        last_key = getattr(rows[-1], key.key)
+
+def iter_json_array(response, array_key=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields the elements of a JSON array from a response opened with stream=True, parsing
+    incrementally so only one network chunk and the current element are held in memory.
+
+    Without array_key the document itself must be the array (Radarr/Sonarr lists). With
+    array_key, the first '"<array_key>": [' in the document is used.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    start_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(array_key)) if array_key else re.compile(r'\s*\[')
+    chunks = response.iter_content(chunk_size=chunk_size)
+    buffer = ''
+    pos = 0
+    in_array = False
+    exhausted = False
+
+    def read_more():
+        nonlocal buffer, pos, exhausted
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer = buffer[pos:] + text_decoder.decode(b'', final=True)
+        else:
+            buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+
+    while True:
+        if not in_array:
+            match = start_pattern.search(buffer, pos)
+            if match:
+                pos = match.end()
+                in_array = True
+                continue
+            if exhausted:
+                raise ValueError('JSON array not found in response')
+            # Keep a short tail in case the opening pattern straddles two chunks
+            pos = max(pos, len(buffer) - 256)
+            read_more()
+            continue
+
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # An element touching the end of the buffer may be truncated (e.g. a number)
+            if end < len(buffer) or exhausted:
+                pos = end
+                yield item
+                continue
+        except json.JSONDecodeError:
+            if exhausted:
+                raise
+        read_more()
+
+def iter_batches(iterable, size):
+    """Groups any iterable into lists of at most size items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def content_fingerprint(row, score):
+    """
+    Hashes the synced columns of a row together with its local score. A changed
+    score must re-trigger tag reconciliation, so it is part of the fingerprint.
+    """
+    payload = json.dumps([row, score], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class ProgressReporter:
+    """
+    Throttled writer for the job meta fields read by /task_status ('progress' and 'eta').
+
+    update() only records the new position; job.save_meta() runs once flush_items items
+    have been reported or flush_ms milliseconds have passed since the last write, whichever
+    comes first. Extra meta fields passed to update() are written with the next flush.
+    Every flush is also published on the job's pub/sub channel for /task_events streams.
+    """
+    def __init__(self, job, total=0, flush_items=PROGRESS_FLUSH_ITEMS, flush_ms=PROGRESS_FLUSH_MS):
+        self.job = job
+        self.flush_items = flush_items
+        self.flush_interval = flush_ms / 1000.0
+        self.last_flush = 0.0
+        self.unflushed = 0
+        self.start(total)
+
+    def start(self, total):
+        """Begins a new phase (e.g. the asset stage after the library pass) with its own ETA."""
+        self.total = total
+        self.done = 0
+        self.start_time = time.time()
+
+    def update(self, done=None, advance=1, **meta):
+        if done is None:
+            done = self.done + advance
+        self.unflushed += max(done - self.done, 1)
+        self.done = done
+        self.job.meta.update(meta)
+        if self.unflushed >= self.flush_items or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, progress=None):
+        if progress is None:
+            # 100% is reserved for finish(); the task may still be writing results
+            fraction = min(self.done / self.total, 0.99) if self.total else 0
+            progress = int(fraction * 100)
+        else:
+            fraction = progress / 100
+        if fraction > 0:
+            elapsed_time = time.time() - self.start_time
+            eta_seconds = (elapsed_time / fraction) * (1 - fraction)
+            self.job.meta['eta'] = time.strftime("%M:%S", time.gmtime(eta_seconds))
+        self.job.meta['progress'] = progress
+        self.job.save_meta()
+        publish_job_progress(self.job)
+        self.unflushed = 0
+        self.last_flush = time.monotonic()
+
+    def finish(self):
+        self.flush(progress=100)
+
+class RateLimiter:
+    """
+    Thread-safe token bucket. acquire() blocks until a token is available, so
+    any number of worker threads can share one limiter.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate) if rate and rate > 0 else 0
+        self.capacity = float(burst or max(1, self.rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def get_tmdb_settings():
+    """Returns (api_key, concurrency, rate_limit) from the Radarr row, which holds the shared TMDB key."""
     settings = ServiceSettings.query.filter_by(service_name='Radarr').first()
     if not settings or not settings.tmdb_api_key:
-        return None, None
-        
-    tmdb_api_key = settings.tmdb_api_key
-    session = get_retry_session()
-    
-    tmdb_id = None
+        return None, DEFAULT_TMDB_CONCURRENCY, DEFAULT_TMDB_RATE_LIMIT
+    return (
+        settings.tmdb_api_key,
+        max(1, settings.tmdb_concurrency or DEFAULT_TMDB_CONCURRENCY),
+        max(0, settings.tmdb_rate_limit or DEFAULT_TMDB_RATE_LIMIT)
+    )
+
+def load_poster_cache(media_type):
+    """Snapshot of the poster cache for one media type as plain dicts keyed by cache key."""
+    return {
+        row.key: {column.name: getattr(row, column.name) for column in PosterCache.__table__.columns if column.name != 'id'}
+        for row in PosterCache.query.filter_by(media_type=media_type)
+    }
+
+def poster_miss(cache_key, media_type, tmdb_id):
+    """Poster cache entry recording that TMDB has no poster (or no entry at all) for an item."""
+    return {
+        'key': cache_key,
+        'media_type': media_type,
+        'tmdb_id': tmdb_id,
+        'poster_path': None,
+        'etag': None,
+        'last_modified': None,
+        'content_hash': None,
+        'local_path': None,
+        'checked_at': datetime.utcnow()
+    }
+
+def is_recent_poster_miss(poster_cache, cache_key):
+    """True when the last TMDB lookup for cache_key found no poster less than POSTER_REVALIDATE_DAYS ago."""
+    cached = poster_cache.get(cache_key)
+    return bool(
+        cached and not cached['local_path'] and cached['checked_at']
+        and datetime.utcnow() - cached['checked_at'] < timedelta(days=POSTER_REVALIDATE_DAYS)
+    )
+
+def write_poster_file(content):
+    """Stores poster bytes under their SHA-256 and returns (content_hash, local_path)."""
+    content_hash = hashlib.sha256(content).hexdigest()
+    local_path = f"posters/{content_hash}.jpg"
+    local_filepath = os.path.join('/appdata', local_path)
+    if not os.path.exists(local_filepath):
+        os.makedirs(os.path.dirname(local_filepath), exist_ok=True)
+        # Write to a temporary file first so a concurrent reader never sees a partial image
+        tmp_filepath = f"{local_filepath}.{threading.get_ident()}.tmp"
+        with open(tmp_filepath, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_filepath, local_filepath)
+    return content_hash, local_path
+
+def store_poster(session_get, poster_path, cache_key, media_type, tmdb_id, cached=None):
+    """
+    Returns a poster cache entry for poster_path, downloading only when needed.
+
+    A cached poster with the same TMDB path is reused as-is; once it is older than
+    POSTER_REVALIDATE_DAYS it is revalidated with a conditional GET. Files are named
+    after the SHA-256 of their content, so identical images are stored once. A poster
+    saved by earlier versions as posters/{media_type}_{tmdb_id}.jpg is adopted on its
+    first cache miss instead of being downloaded again.
+    """
+    now = datetime.utcnow()
+    if cached is None:
+        legacy_filepath = os.path.join('/appdata', 'posters', f"{cache_key}.jpg")
+        if os.path.exists(legacy_filepath):
+            # Copied, not moved: item rows point at the old name until the sync rewrites them.
+            # No validators are kept, so the first revalidation fetches the current image.
+            with open(legacy_filepath, 'rb') as f:
+                content_hash, local_path = write_poster_file(f.read())
+            return {
+                'key': cache_key,
+                'media_type': media_type,
+                'tmdb_id': tmdb_id,
+                'poster_path': poster_path,
+                'etag': None,
+                'last_modified': None,
+                'content_hash': content_hash,
+                'local_path': local_path,
+                'checked_at': now
+            }
+
+    headers = {}
+    if cached and cached['poster_path'] == poster_path and cached['local_path'] \
+            and os.path.exists(os.path.join('/appdata', cached['local_path'])):
+        if cached['checked_at'] and now - cached['checked_at'] < timedelta(days=POSTER_REVALIDATE_DAYS):
+            return cached
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    poster_response = session_get(f"https://image.tmdb.org/t/p/w500{poster_path}", headers=headers)
+    if poster_response.status_code == 304:
+        return dict(cached, checked_at=now)
+
+    content_hash, local_path = write_poster_file(poster_response.content)
+
+    return {
+        'key': cache_key,
+        'media_type': media_type,
+        'tmdb_id': tmdb_id,
+        'poster_path': poster_path,
+        'etag': poster_response.headers.get('ETag'),
+        'last_modified': poster_response.headers.get('Last-Modified'),
+        'content_hash': content_hash,
+        'local_path': local_path,
+        'checked_at': now
+    }
+
+def remove_orphaned_posters():
+    """
+    Deletes poster files that neither a PosterCache row nor a movie or show references:
+    images replaced after a TMDB poster change and adopted legacy files. Files younger
+    than ORPHAN_POSTER_MIN_AGE_SECONDS are kept. Returns the number of files removed.
+    """
+    posters_dir = os.path.join('/appdata', 'posters')
+    if not os.path.isdir(posters_dir):
+        return 0
+    referenced = set()
+    for column in (PosterCache.local_path, Movie.local_poster_path, Show.local_poster_path):
+        referenced.update(path for (path,) in db.session.query(column).filter(column != None))
+
+    cutoff = time.time() - ORPHAN_POSTER_MIN_AGE_SECONDS
+    removed = 0
+    for entry in os.scandir(posters_dir):
+        if not entry.is_file() or f"posters/{entry.name}" in referenced or entry.stat().st_mtime > cutoff:
+            continue
+        try:
+            os.remove(entry.path)
+            removed += 1
+        except OSError as e:
+            print(f"Could not remove orphaned poster {entry.name}: {e}")
+    return removed
+
+def download_tmdb_assets(session, tmdb_api_key, media_id, media_type='movie', tmdb_id=None, limiter=None, poster_cache=None):
+    """
+    Fetches details, cast and poster for one item from TMDB and writes the poster to disk.
+    Does not touch the database, so it is safe to run from worker threads; poster_cache is
+    a read-only snapshot from load_poster_cache.
+    Returns a dict with local_poster_path, tmdb_id, overview, cast and the updated
+    poster_cache entry, or None if the lookup failed. When TMDB has no poster or no entry
+    for the item, local_poster_path is None and poster_cache records the miss.
+    """
+    def get(url, headers=None):
+        if limiter:
+            limiter.acquire()
+        response = session.get(url, headers=headers)
+        response.raise_for_status()
+        return response
+
     if media_type == 'movie':
         tmdb_id = media_id
-    elif media_type == 'tv':
+    elif media_type == 'tv' and not tmdb_id:
         # Find the TMDB ID from the TVDB ID
         find_url = f"https://api.themoviedb.org/3/find/{media_id}?api_key={tmdb_api_key}&external_source=tvdb_id"
         try:
-            find_response = session.get(find_url)
-            find_response.raise_for_status()
-            find_data = find_response.json()
+            find_data = get(find_url).json()
             if find_data['tv_results']:
                 tmdb_id = find_data['tv_results'][0]['id']
         except requests.exceptions.RequestException as e:
             print(f"Error finding TMDB ID for TVDB ID {media_id}: {e}")
-            return None, None
+            return None
 
     if not tmdb_id:
         print(f"No TMDB ID found for {media_type} {media_id}")
-        return None, None
+        return {
+            'local_poster_path': None,
+            'tmdb_id': None,
+            'overview': None,
+            'cast': None,
+            'poster_cache': poster_miss(f"{media_type}_tvdb_{media_id}", media_type, None)
+        }
 
     url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}?api_key={tmdb_api_key}&append_to_response=credits"
-        
+
     try:
-        response = session.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
+        data = get(url).json()
+
         # Extract cast
         cast_list = []
         if 'credits' in data and 'cast' in data['credits']:
             # Get top 5 cast members
             cast_list = [actor['name'] for actor in data['credits']['cast'][:5]]
-        
-        cast_str = ", ".join(cast_list)
 
+        cache_key = f"{media_type}_{tmdb_id}"
         poster_path = data.get('poster_path')
-        if poster_path:
-            poster_url = f"https://image.tmdb.org/t/p/w500{poster_path}"
-            poster_response = session.get(poster_url)
-            poster_response.raise_for_status()
-            
-            local_filename = f"{media_type}_{tmdb_id}.jpg"
-            local_filepath = os.path.join('/appdata', 'posters', local_filename)
-            
-            os.makedirs(os.path.dirname(local_filepath), exist_ok=True)
-
-            with open(local_filepath, 'wb') as f:
-                f.write(poster_response.content)
-            
-            if media_type == 'movie':
-                item = Movie.query.filter_by(tmdb_id=media_id).first()
-                if item:
-                    item.overview = data.get('overview')
-                    item.cast = cast_str
-                    db.session.commit()
-            elif media_type == 'tv':
-                item = Show.query.filter_by(tvdb_id=media_id).first()
-                if item:
-                    item.overview = data.get('overview')
-                    item.cast = cast_str
-                    db.session.commit()
-
-            return f"posters/{local_filename}", tmdb_id
+        if not poster_path:
+            return {
+                'local_poster_path': None,
+                'tmdb_id': tmdb_id,
+                'overview': data.get('overview'),
+                'cast': ", ".join(cast_list),
+                'poster_cache': poster_miss(cache_key, media_type, tmdb_id)
+            }
+
+        cache_entry = store_poster(get, poster_path, cache_key, media_type, tmdb_id, (poster_cache or {}).get(cache_key))
+
+        return {
+            'local_poster_path': cache_entry['local_path'],
+            'tmdb_id': tmdb_id,
+            'overview': data.get('overview'),
+            'cast': ", ".join(cast_list),
+            'poster_cache': cache_entry
+        }
 
     except requests.exceptions.RequestException as e:
+        if e.response is not None and e.response.status_code == 404:
+            print(f"No TMDB entry for {media_type} {tmdb_id}")
+            return {
+                'local_poster_path': None,
+                'tmdb_id': tmdb_id,
+                'overview': None,
+                'cast': None,
+                'poster_cache': poster_miss(f"{media_type}_{tmdb_id}", media_type, tmdb_id)
+            }
         print(f"Error fetching TMDB assets for {media_type} {media_id}: {e}")
 
-    return None, None
+    return None
+
+def iter_tmdb_assets(items, tmdb_api_key, concurrency=DEFAULT_TMDB_CONCURRENCY, rate_limit=DEFAULT_TMDB_RATE_LIMIT, poster_cache=None):
+    """
+    Runs download_tmdb_assets for (key, media_id, media_type, tmdb_id) tuples in a bounded
+    thread pool sharing one TMDB rate limiter. Yields (key, assets) in completion order;
+    the caller applies the results to the database on its own thread. Breaking out of the
+    loop cancels everything that has not started yet.
+    """
+    concurrency = max(1, concurrency)
+    limiter = RateLimiter(rate_limit)
+    session = get_http_session()
+
+    def worker(media_id, media_type, tmdb_id):
+        return download_tmdb_assets(session, tmdb_api_key, media_id, media_type, tmdb_id, limiter, poster_cache)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = {}
+    queue = iter(items)
+    try:
+        # Keep a bounded number of items in flight instead of submitting the whole library
+        for key, media_id, media_type, tmdb_id in itertools.islice(queue, concurrency * 2):
+            pending[executor.submit(worker, media_id, media_type, tmdb_id)] = key
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    assets = future.result()
+                except Exception as e:
+                    print(f"Error fetching TMDB assets for {key}: {e}")
+                    assets = None
+                for next_key, media_id, media_type, tmdb_id in itertools.islice(queue, 1):
+                    pending[executor.submit(worker, media_id, media_type, tmdb_id)] = next_key
+                yield key, assets
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def fetch_tmdb_assets(media_id, media_type='movie'):
+    tmdb_api_key, _, _ = get_tmdb_settings()
+    if not tmdb_api_key:
+        return None, None
+
+    assets = download_tmdb_assets(get_retry_session(), tmdb_api_key, media_id, media_type, poster_cache=load_poster_cache(media_type))
+    if not assets:
+        return None, None
+    if not assets['local_poster_path']:
+        # Remember the miss so syncs do not ask TMDB again until it is due for revalidation
+        bulk_upsert(PosterCache, 'key', [assets['poster_cache']])
+        db.session.commit()
+        return None, None
+
+    if media_type == 'movie':
+        item = Movie.query.filter_by(tmdb_id=media_id).first()
+    else:
+        item = Show.query.filter_by(tvdb_id=media_id).first()
+    if item:
+        item.overview = assets['overview']
+        item.cast = assets['cast']
+    bulk_upsert(PosterCache, 'key', [assets['poster_cache']])
+    db.session.commit()
+
+    return assets['local_poster_path'], assets['tmdb_id']
+
+def _tag_cache_key(service_name):
+    return f"tag-map:{service_name}"
+
+def cache_tag_map(service_name, tags):
+    """
+    Stores a service's tags as a Redis hash of lowercased label -> id so the web and
+    worker processes share one copy. The sentinel field marks a loaded-but-empty map.
+    """
+    redis_conn = current_app.queue.connection
+    key = _tag_cache_key(service_name)
+    mapping = {tag['label'].lower(): tag['id'] for tag in tags}
+    pipe = redis_conn.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping={TAG_CACHE_SENTINEL: 1, **mapping})
+    pipe.expire(key, TAG_CACHE_TTL)
+    pipe.execute()
+    return mapping
+
+def invalidate_tag_map(service_name):
+    current_app.queue.connection.delete(_tag_cache_key(service_name))
+
+def get_tag_map(service_name, settings, session, refresh=False):
+    """Returns {label.lower(): id} for a service, served from Redis unless missing, expired or refresh=True."""
+    if not refresh:
+        cached = current_app.queue.connection.hgetall(_tag_cache_key(service_name))
+        if cached:
+            return {label.decode(): int(tag_id) for label, tag_id in cached.items() if label.decode() != TAG_CACHE_SENTINEL}
+
+    tags_response = session.get(f"{settings.url}/api/v3/tag", headers={'X-Api-Key': settings.api_key})
+    tags_response.raise_for_status()
+    return cache_tag_map(service_name, tags_response.json())
 
 def update_service_tags(service_name, payload):
     settings = ServiceSettings.query.filter_by(service_name=service_name).first()
@@ -115,44 +604,55 @@ def update_service_tags(service_name, payload):
     else:
         return {'error': 'Invalid service name for tag update'}
 
-    try:
-        tags_response = session.get(tags_url, headers=headers)
-        tags_response.raise_for_status()
-        tags_data = tags_response.json()
-        label_to_id_map = {tag['label'].lower(): tag['id'] for tag in tags_data}
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching tags for {service_name}: {e}")
-        return {'error': f'Could not fetch tags for {service_name}'}
-
-    # Process tags to add
-    if payload.get('tagsToAdd'):
-        labels_to_add = payload['tagsToAdd']
-        ids_to_add = []
-        for label in labels_to_add:
-            if label.lower() not in label_to_id_map:
-                try:
-                    print(f"Tag '{label}' not found for {service_name}. Creating it.")
-                    create_tag_response = session.post(tags_url, headers=headers, json={'label': label})
-                    create_tag_response.raise_for_status()
-                    new_tag = create_tag_response.json()
-                    label_to_id_map[new_tag['label'].lower()] = new_tag['id']
-                    ids_to_add.append(new_tag['id'])
-                except requests.exceptions.RequestException as e:
-                    print(f"Error creating tag '{label}' for {service_name}: {e}")
-            else:
-                ids_to_add.append(label_to_id_map[label.lower()])
-        
-        if ids_to_add:
-            add_payload = {id_key: payload[id_key], "tags": ids_to_add, "applyTags": "add"}
-            session.put(editor_url, headers=headers, json=add_payload)
-
-    # Process tags to remove
-    if payload.get('tagsToRemove'):
-        labels_to_remove = payload['tagsToRemove']
-        ids_to_remove = [label_to_id_map[label.lower()] for label in labels_to_remove if label.lower() in label_to_id_map]
-        
-        if ids_to_remove:
-            remove_payload = {id_key: payload[id_key], "tags": ids_to_remove, "applyTags": "remove"}
-            session.put(editor_url, headers=headers, json=remove_payload)
+    # A cached id can go stale if a tag is deleted in Radarr/Sonarr. If the editor rejects
+    # the request, drop the cache and retry once against a freshly fetched map.
+    for refresh in (False, True):
+        try:
+            label_to_id_map = get_tag_map(service_name, settings, session, refresh=refresh)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching tags for {service_name}: {e}")
+            return {'error': f'Could not fetch tags for {service_name}'}
+
+        rejected = False
+
+        # Process tags to add
+        if payload.get('tagsToAdd'):
+            labels_to_add = payload['tagsToAdd']
+            ids_to_add = []
+            for label in labels_to_add:
+                if label.lower() not in label_to_id_map:
+                    try:
+                        print(f"Tag '{label}' not found for {service_name}. Creating it.")
+                        create_tag_response = session.post(tags_url, headers=headers, json={'label': label})
+                        create_tag_response.raise_for_status()
+                        new_tag = create_tag_response.json()
+                        label_to_id_map[new_tag['label'].lower()] = new_tag['id']
+                        ids_to_add.append(new_tag['id'])
+                        # Other processes must not keep serving a map without the new tag
+                        invalidate_tag_map(service_name)
+                    except requests.exceptions.RequestException as e:
+                        print(f"Error creating tag '{label}' for {service_name}: {e}")
+                else:
+                    ids_to_add.append(label_to_id_map[label.lower()])
+
+            if ids_to_add:
+                add_payload = {id_key: payload[id_key], "tags": ids_to_add, "applyTags": "add"}
+                response = session.put(editor_url, headers=headers, json=add_payload)
+                rejected = rejected or 400 <= response.status_code < 500
+
+        # Process tags to remove
+        if payload.get('tagsToRemove'):
+            labels_to_remove = payload['tagsToRemove']
+            ids_to_remove = [label_to_id_map[label.lower()] for label in labels_to_remove if label.lower() in label_to_id_map]
+
+            if ids_to_remove:
+                remove_payload = {id_key: payload[id_key], "tags": ids_to_remove, "applyTags": "remove"}
+                response = session.put(editor_url, headers=headers, json=remove_payload)
+                rejected = rejected or 400 <= response.status_code < 500
+
+        if not rejected:
+            break
+        print(f"{service_name} rejected a tag update; refreshing cached tags.")
+        invalidate_tag_map(service_name)
 
     return {'status': 'Tag update process completed'}
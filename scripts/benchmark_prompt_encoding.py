@@ -0,0 +1,111 @@
+"""
+Compares the prompt encodings used for AI scoring on a fixture library.
+
+For every encoding it reports the scoring prompt size (characters and tokens) and how many
+batches the token-budget planner makes. With --live it also sends each prompt to the
+provider configured in the app database and reports response latency.
+
+    python scripts/benchmark_prompt_encoding.py
+    python scripts/benchmark_prompt_encoding.py --live --repeat 3
+    python scripts/benchmark_prompt_encoding.py --fixture my_library.json --budget 4000
+
+Token counts use tiktoken when it is installed and the app's character estimate otherwise.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ai_service import AIService, PROMPT_ENCODINGS, truncate_overview
+from app.ai_limiter import estimate_tokens
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'library_sample.json')
+
+def count_tokens(text, model):
+    try:
+        import tiktoken
+    except ImportError:
+        return estimate_tokens(text)
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding('cl100k_base')
+    return len(encoding.encode(text))
+
+def load_settings(live):
+    if not live:
+        # Offline runs only build prompts; the values below never reach a provider
+        return SimpleNamespace(
+            provider='OpenAI', api_key='offline', learning_model='gpt-4o', scoring_model='gpt-4o-mini',
+            requests_per_minute=0, tokens_per_minute=0, scoring_concurrency=1, prompt_encoding='json'
+        )
+
+    from app import create_app
+    from app.models import AISettings
+    app = create_app()
+    app.app_context().push()
+    settings = AISettings.query.first()
+    if not settings or not settings.api_key:
+        sys.exit('AI is not configured in this database.')
+    return settings
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prompt encodings for AI scoring.')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE, help='JSON file with "rules" and "items"')
+    parser.add_argument('--budget', type=int, default=0, help='Prompt token budget for batch planning (0 = model default)')
+    parser.add_argument('--live', action='store_true', help='Send the prompts to the configured provider and time them')
+    parser.add_argument('--repeat', type=int, default=3, help='Live calls per encoding')
+    args = parser.parse_args()
+
+    with open(args.fixture) as f:
+        fixture = json.load(f)
+    rules = fixture['rules']
+    items = [dict(item, overview=truncate_overview(item.get('overview'))) for item in fixture['items']]
+
+    settings = load_settings(args.live)
+    service = AIService(settings)
+
+    rows = []
+    for encoding in PROMPT_ENCODINGS:
+        service.prompt_encoding = encoding
+        prompt = service.scoring_prompt(items, rules)
+        batches = list(service.plan_scoring_batches(items, rules, args.budget or None))
+        row = {
+            'encoding': encoding,
+            'chars': len(prompt),
+            'tokens': count_tokens(prompt, service.scoring_model),
+            'batches': len(batches),
+        }
+
+        if args.live:
+            latencies = []
+            scored = 0
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                scores = service.score_items(items, rules)
+                latencies.append(time.perf_counter() - start)
+                scored = len(scores)
+            row['latency_median'] = statistics.median(latencies)
+            row['latency_max'] = max(latencies)
+            row['scored'] = scored
+        rows.append(row)
+
+    baseline = rows[0]['tokens']
+    print(f"{len(items)} items, model {service.scoring_model}")
+    header = f"{'encoding':<10}{'chars':>10}{'tokens':>10}{'vs json':>10}{'batches':>10}"
+    if args.live:
+        header += f"{'median s':>11}{'max s':>9}{'scored':>9}"
+    print(header)
+    for row in rows:
+        line = f"{row['encoding']:<10}{row['chars']:>10}{row['tokens']:>10}{row['tokens'] / baseline - 1:>+10.0%}{row['batches']:>10}"
+        if args.live:
+            line += f"{row['latency_median']:>11.2f}{row['latency_max']:>9.2f}{row['scored']:>6}/{len(items)}"
+        print(line)
+
+if __name__ == '__main__':
+    main()
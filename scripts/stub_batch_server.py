@@ -0,0 +1,168 @@
+"""
+Local stand-in for the OpenAI Batch and Gemini batch mode endpoints used by bulk scoring.
+
+Every submitted batch completes on its first status check, and every item in a scoring
+prompt gets the same score. Run it, then point the worker at it:
+
+    python scripts/stub_batch_server.py --port 8089 --score 50
+    OPENAI_BASE_URL=http://localhost:8089/v1 GEMINI_API_BASE_URL=http://localhost:8089 python worker.py
+
+Only the calls made by app/ai_batch.py are implemented.
+"""
+import argparse
+import email
+import email.policy
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+files = {}
+batches = {}
+
+def item_ids(prompt):
+    """Item ids from a scoring prompt in any of the prompt encodings."""
+    ids = re.findall(r'"id":\s*(\d+)', prompt)
+    if ids:
+        return ids
+    lines = [line.strip() for line in prompt.splitlines()]
+    if 'id' not in [line.split('\t')[0] for line in lines]:
+        return []
+    start = [line.split('\t')[0] for line in lines].index('id') + 1
+    ids = []
+    for line in lines[start:]:
+        cell = line.split('\t')[0]
+        if not cell.isdigit():
+            break
+        ids.append(cell)
+    return ids
+
+def answer(prompt, score):
+    return json.dumps({item_id: score for item_id in item_ids(prompt)})
+
+class StubHandler(BaseHTTPRequestHandler):
+    score = 50
+
+    def _send(self, payload, status=200, raw=False):
+        body = payload.encode('utf-8') if raw else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream' if raw else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path == '/v1/files':
+            # Multipart upload from the OpenAI SDK; only the file part matters
+            message = email.message_from_bytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + self._body(),
+                policy=email.policy.HTTP
+            )
+            content = next(part.get_payload(decode=True) for part in message.iter_parts() if part.get_filename())
+            file_id = f"file-{uuid.uuid4().hex[:12]}"
+            files[file_id] = content.decode('utf-8')
+            return self._send({'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                               'filename': 'batch.jsonl', 'purpose': 'batch', 'status': 'processed'})
+        if path == '/v1/batches':
+            request = json.loads(self._body())
+            batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+            batches[batch_id] = {'provider': 'OpenAI', 'input_file_id': request['input_file_id'], 'status': 'validating'}
+            return self._send(self._openai_batch(batch_id))
+        match = re.fullmatch(r'/v1/batches/([^/]+)/cancel', path)
+        if match:
+            batches[match.group(1)]['status'] = 'cancelled'
+            return self._send(self._openai_batch(match.group(1)))
+        match = re.fullmatch(r'/v1beta/models/([^/:]+):batchGenerateContent', path)
+        if match:
+            request = json.loads(self._body())
+            name = f"batches/{uuid.uuid4().hex[:12]}"
+            batches[name] = {'provider': 'Gemini', 'requests': request['batch']['input_config']['requests']['requests'],
+                             'state': 'BATCH_STATE_PENDING'}
+            return self._send(self._gemini_operation(name))
+        match = re.fullmatch(r'/v1beta/(batches/[^/:]+):cancel', path)
+        if match:
+            batches[match.group(1)]['state'] = 'BATCH_STATE_CANCELLED'
+            return self._send({})
+        self._send({'error': {'message': f'Unknown path {path}'}}, status=404)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        match = re.fullmatch(r'/v1/batches/([^/]+)', path)
+        if match:
+            batch = batches[match.group(1)]
+            if batch['status'] == 'validating':
+                self._complete_openai(match.group(1))
+            return self._send(self._openai_batch(match.group(1)))
+        match = re.fullmatch(r'/v1/files/([^/]+)/content', path)
+        if match:
+            return self._send(files[match.group(1)], raw=True)
+        match = re.fullmatch(r'/v1beta/(batches/[^/:]+)', path)
+        if match:
+            batch = batches[match.group(1)]
+            if batch['state'] == 'BATCH_STATE_PENDING':
+                batch['state'] = 'BATCH_STATE_SUCCEEDED'
+            return self._send(self._gemini_operation(match.group(1)))
+        self._send({'error': {'message': f'Unknown path {path}'}}, status=404)
+
+    def _complete_openai(self, batch_id):
+        batch = batches[batch_id]
+        lines = []
+        for line in files[batch['input_file_id']].splitlines():
+            request = json.loads(line)
+            prompt = request['body']['messages'][-1]['content']
+            lines.append(json.dumps({
+                'id': f"req_{uuid.uuid4().hex[:8]}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'body': {'choices': [{'message': {'role': 'assistant', 'content': answer(prompt, self.score)}}]}},
+                'error': None
+            }))
+        output_file_id = f"file-{uuid.uuid4().hex[:12]}"
+        files[output_file_id] = '\n'.join(lines)
+        batch.update(status='completed', output_file_id=output_file_id, total=len(lines))
+
+    def _openai_batch(self, batch_id):
+        batch = batches[batch_id]
+        total = batch.get('total', 0)
+        return {
+            'id': batch_id, 'object': 'batch', 'endpoint': '/v1/chat/completions', 'completion_window': '24h',
+            'created_at': int(time.time()), 'input_file_id': batch['input_file_id'], 'status': batch['status'],
+            'output_file_id': batch.get('output_file_id'),
+            'request_counts': {'total': total, 'completed': total if batch['status'] == 'completed' else 0, 'failed': 0}
+        }
+
+    def _gemini_operation(self, name):
+        batch = batches[name]
+        done = batch['state'] != 'BATCH_STATE_PENDING'
+        count = len(batch['requests'])
+        metadata = {
+            'name': name, 'state': batch['state'],
+            'batchStats': {'requestCount': str(count), 'successfulRequestCount': str(count if done else 0)}
+        }
+        operation = {'name': name, 'metadata': metadata, 'done': done}
+        if batch['state'] == 'BATCH_STATE_SUCCEEDED':
+            operation['response'] = {'inlinedResponses': {'inlinedResponses': [
+                {
+                    'metadata': request.get('metadata', {}),
+                    'response': {'candidates': [{'content': {'parts': [{'text': answer(request['request']['contents'][0]['parts'][0]['text'], self.score)}]}}]}
+                }
+                for request in batch['requests']
+            ]}}
+        return operation
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub provider batch API for bulk scoring.')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--score', type=int, default=50, help='Score returned for every item')
+    args = parser.parse_args()
+    StubHandler.score = args.score
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), StubHandler)
+    print(f"Stub batch API listening on http://localhost:{args.port}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
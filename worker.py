@@ -1,17 +1,25 @@
 import os
 import redis
-from rq import Worker, Queue, Connection
+from rq import Worker, SimpleWorker, Queue, Connection
 from app import create_app
 
-listen = ['default']
+# Queues this worker listens on, comma-separated, highest priority first. supervisord runs one
+# worker on 'default' and a separate one on 'tags', so tag changes never wait behind a sync,
+# scoring run or bulk job. A lone worker should listen on 'tags,default'.
+listen = os.getenv('RQ_QUEUES', 'tags,default').split(',')
 
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
 
 conn = redis.from_url(redis_url)
 
+# The default worker forks a fresh process per job, so HTTP pools and AI clients are rebuilt
+# for every job. RQ_SIMPLE_WORKER=1 runs jobs in the worker process itself and keeps them warm.
+worker_class = SimpleWorker if os.getenv('RQ_SIMPLE_WORKER', '0') == '1' else Worker
+
 if __name__ == '__main__':
     app = create_app()
     app.app_context().push()
     with Connection(conn):
-        worker = Worker(map(Queue, listen))
-        worker.work()
+        worker = worker_class(map(Queue, listen))
+        # The scheduler moves jobs queued with enqueue_in (bulk scoring status checks) onto their queue when due
+        worker.work(with_scheduler=True)